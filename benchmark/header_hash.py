@@ -0,0 +1,35 @@
+"""
+Compares hashes per second for the header encodings.
+Run from the project root: python -m benchmark.header_hash
+"""
+import time
+
+from node.chain.header import BlockHeader, HEADER_ENCODING_JSON, HEADER_ENCODING_BINARY
+
+ATTEMPTS = 200000
+
+
+def _bench(name, hash_nonce):
+    start = time.perf_counter()
+    for nonce in range(ATTEMPTS):
+        hash_nonce(nonce)
+    elapsed = time.perf_counter() - start
+    print("{:<28}{:>12.0f} H/s".format(name, ATTEMPTS / elapsed))
+
+
+def _json_compute_hash(header):
+    def hash_nonce(nonce):
+        header.nonce = nonce
+        return header.compute_hash()
+    return hash_nonce
+
+
+if __name__ == "__main__":
+    previous_hash, merkle_root = "ab" * 32, "cd" * 32
+
+    json_header = BlockHeader(previous_hash, merkle_root, HEADER_ENCODING_JSON)
+    binary_header = BlockHeader(previous_hash, merkle_root, HEADER_ENCODING_BINARY)
+
+    _bench("JSON compute_hash", _json_compute_hash(json_header))
+    _bench("JSON midstate template", json_header.hash_template().hash_nonce)
+    _bench("Binary midstate template", binary_header.hash_template().hash_nonce)
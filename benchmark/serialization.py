@@ -0,0 +1,45 @@
+"""
+Compares the nested serialize() encoding with the single pass to_dict() encoding.
+Run from the project root: python -m benchmark.serialization
+"""
+import json
+import time
+
+from benchmark.wire_format import _create_block
+from util import serialize
+from util.serialize import JsonSerializable, dumps, loads
+
+ROUNDS = 20
+
+
+def _bench(name, function):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function()
+    elapsed = time.perf_counter() - start
+    print("{:<36}{:>10.2f} ms".format(name, elapsed / ROUNDS * 1000))
+
+
+if __name__ == "__main__":
+    block = _create_block()
+    mempool = list(block.transactions)
+
+    print("orjson:", "installed" if serialize.orjson is not None else "not installed")
+
+    # Encoding used before to_dict(): every transaction is a JSON string inside the outer JSON.
+    def nested_dump():
+        return json.dumps({"header": block.header,
+                           "index": block.index,
+                           "transactions": block.transactions,
+                           "data": block.data,
+                           "hash": block.hash}, default=JsonSerializable.dumper, indent=4)
+
+    nested_block = nested_dump()
+    single_pass_block = block.serialize()
+
+    _bench("Block serialize() nested", nested_dump)
+    _bench("Block to_dict() + dumps()", block.serialize)
+    _bench("Mempool nested dump", lambda: json.dumps(mempool, default=JsonSerializable.dumper, indent=4))
+    _bench("Mempool dumps()", lambda: dumps(mempool))
+    _bench("Block nested decode", lambda: [json.loads(tx) for tx in json.loads(nested_block)["transactions"]])
+    _bench("Block single pass decode", lambda: loads(single_pass_block))
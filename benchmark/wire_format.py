@@ -0,0 +1,59 @@
+"""
+Compares size and speed of the JSON and binary wire formats for a block.
+Run from the project root: python -m benchmark.wire_format
+"""
+import json
+import time
+
+from node.chain.block import Block
+from node.chain.header import BlockHeader
+from transaction.tx_output import TransactionOutput
+from transaction.type import CoinTX
+from util import wire
+from util.hash import apply_sha256, merkle_root
+from wallet.private import PrivateWallet
+
+TRANSACTIONS = 500
+ROUNDS = 20
+
+
+def _bench(name, function):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function()
+    elapsed = time.perf_counter() - start
+    print("{:<28}{:>10.2f} ms".format(name, elapsed / ROUNDS * 1000))
+
+
+def _create_block():
+    sender, receiver = PrivateWallet.genesis_wallet(), PrivateWallet.random_wallet()
+    transactions = []
+
+    for idx in range(TRANSACTIONS):
+        tx = CoinTX(sender.pk_str, receiver.pk_str, idx + 1, [TransactionOutput(apply_sha256(sender.pk_str),
+                                                                               1000, "ab" * 32, idx)])
+        sender.sign_transaction(tx)
+        tx.tx_outputs = [TransactionOutput(apply_sha256(receiver.pk_str), idx + 1, tx.tx_id, 0),
+                         TransactionOutput(apply_sha256(sender.pk_str), 999 - idx, tx.tx_id, 1)]
+        transactions.append(tx)
+
+    header = BlockHeader("cd" * 32, merkle_root(transactions))
+    return Block(1, transactions, header)
+
+
+if __name__ == "__main__":
+    block = _create_block()
+
+    json_data = block.serialize().encode()
+    binary_data = wire.encode(block)
+
+    assert wire.decode(binary_data, Block.read_binary).compute_hash() == block.hash
+
+    print("Block with", TRANSACTIONS, "transactions")
+    print("{:<28}{:>10} bytes".format("JSON size", len(json_data)))
+    print("{:<28}{:>10} bytes".format("Binary size", len(binary_data)))
+
+    _bench("JSON encode", block.serialize)
+    _bench("Binary encode", lambda: wire.encode(block))
+    _bench("JSON decode", lambda: Block.from_json(json.loads(json_data)))
+    _bench("Binary decode", lambda: wire.decode(binary_data, Block.read_binary))
@@ -1,34 +1,89 @@
 import json
-from hashlib import sha256
 
-from util.serialize import JsonSerializable
+from node.chain.exceptions import BlockHashError
+from node.chain.header import BlockHeader
+from transaction.type import load_transaction, read_transaction
+from util.serialize import JsonSerializable, dumps
 
 
 class Block(JsonSerializable):
 
-    def __init__(self, index: int, transactions: list, header):
+    # Blocks are sealed: nothing can change after the hash is computed.
+    __slots__ = ("header", "index", "transactions", "data", "hash")
+
+    def __init__(self, index: int, transactions: list, header, data=None):
         """
+        The block is identified by the hash of its header, the merkle root in the header commits to the transactions.
         @param index: Index of the block in the blockchain.
         @param transactions: TX of this block.
+        @param header: BlockHeader instance. Must not be changed after the block is created.
+        @param data: Extra data of the block.
+        """
+        set_field = super().__setattr__
+        set_field("header", header)
+        set_field("index", index)
+        set_field("transactions", tuple(transactions))
+        set_field("data", data if data is not None else {})
+        set_field("hash", header.compute_hash())
+
+    @classmethod
+    def from_json(cls, block_data):
+        """
+        Create a block from its JSON representation.
+        @param block_data: Block as dict.
+        @return: Block instance.
         """
+        block = Block(index=int(block_data["index"]),
+                      transactions=[load_transaction(tx) for tx in block_data["transactions"]],
+                      header=BlockHeader.from_dict(block_data["header"]),
+                      data=block_data["data"])
+
+        return block._check_hash(block_data["hash"])
+
+    @classmethod
+    def read_binary(cls, reader):
+        header = BlockHeader.read_binary(reader)
+        index = reader.read_uint()
+        transactions = [read_transaction(reader) for _ in range(reader.read_uint())]
+
+        block = Block(index=index, transactions=transactions, header=header, data=reader.read_json())
+
+        return block._check_hash(reader.read_hash())
 
-        self.header = header
-        self.index = index
-        self.transactions = transactions
-        self.data = {}
-        self.hash = ""
+    def write_binary(self, writer):
+        self.header.write_binary(writer)
+
+        writer.write_uint(self.index)
+        writer.write_uint(len(self.transactions))
+        for transaction in self.transactions:
+            transaction.write_binary(writer)
+
+        writer.write_json(self.data)
+        writer.write_hash(self.hash)
 
     def compute_hash(self) -> str:
-        block_string = self.serialize()
-        return sha256(block_string.encode()).hexdigest()
+        return self.header.compute_hash()
+
+    def with_transactions(self, transactions):
+        """
+        @return: Copy of this block with other transactions, e.g. to fill in a compact block.
+        """
+        return Block(self.index, transactions, self.header, self.data)
 
     def serialize(self):
-        return json.dumps({"header": self.header,
-                           "index": self.index,
-                           "transactions": self.transactions,
-                           "data": self.data,
-                           "hash": self.hash
-                           }, default=JsonSerializable.dumper, indent=4)
+        return dumps(self.to_dict())
+
+    def to_dict(self):
+        return {"header": self.header.to_dict(),
+                "index": self.index,
+                "transactions": [transaction.to_dict() for transaction in self.transactions],
+                "data": self.data,
+                "hash": self.hash}
+
+    def _check_hash(self, block_hash):
+        if block_hash != self.hash:
+            raise BlockHashError("Block hash does not match its header: " + str(self.index))
+        return self
 
     def __str__(self):
         string = \
@@ -40,5 +95,11 @@ class Block(JsonSerializable):
 
         return string
 
+    def __setattr__(self, name, value):
+        raise AttributeError("Block is sealed.")
 
+    def __delattr__(self, name):
+        raise AttributeError("Block is sealed.")
 
+    def __reduce__(self):
+        return Block, (self.index, self.transactions, self.header, self.data)
@@ -1,10 +1,16 @@
+import json
+import os
 from collections import namedtuple
 
-import ordered_set
 from cryptography.exceptions import InvalidSignature
 
 from node.chain.block import Block
-from node.server.tx import _coin_tx_is_valid
+from node.chain.exceptions import InvalidBlockError, InvalidTransactionError
+from node.chain.filters import BlockFilterIndex, block_filter
+from node.chain.header import BlockHeader, HEADER_ENCODING_JSON
+from node.chain.mempool import Mempool
+from node.chain.store import BlockStore
+from node.chain.utxo import UtxoSet
 from transaction.tx_output import TransactionOutput
 from transaction.type import CoinTX
 
@@ -12,70 +18,381 @@ from transaction.type import CoinTX
 # your node receives, the UTXOs are stored in their own database.
 # The UTXO database is also loaded in to RAM when you run_node bitcoind,
 # which further helps to speed up verification.
-from util.hash import apply_sha256
+from util.hash import apply_sha256, merkle_root
 from wallet.crypto import verify_transaction
 
 TXPosition = namedtuple("TXPosition", ("block_idx", "tx_idx"))
 
+# Previous block hash in the header of the genesis block.
+GENESIS_PREVIOUS_HASH = "0" * 64
+# Coins created by the genesis block, the only coins there are.
+GENESIS_AMOUNT = 21000000
+
 
 class Blockchain:
 
     difficulty = 3
+    header_encoding = HEADER_ENCODING_JSON
 
-    def __init__(self):
-        self.utxo = ordered_set.OrderedSet()
-        self.utxo_pool = ordered_set.OrderedSet()
-        self.memory_pool = ordered_set.OrderedSet()
-        self.chain = []
+    def __init__(self, store=None, utxo=None, filters=None, mempool=None):
+        """
+        @param store: BlockStore that keeps the chain on disk. Only kept in RAM if None.
+        @param utxo: UtxoSet for the unspent outputs. Only kept in RAM if None.
+        @param filters: BlockFilterIndex for the compact block filters. Only kept in RAM if None.
+        @param mempool: Mempool for the pending transactions. Default size cap if None.
+        """
+        self.utxo = utxo if utxo is not None else UtxoSet()
+        self.filters = filters if filters is not None else BlockFilterIndex()
+        self.memory_pool = mempool if mempool is not None else Mempool()
+        self.chain = store if store is not None else []
+        # Only used for chains kept in RAM, a block store has its own indexes.
         self.tx_position = {}
         self.data_position = {}
+        self.block_heights = {}
+
+    @classmethod
+    def from_store(cls, store, mempool=None):
+        """
+        Loads the chain from a block store.
+        Blocks and transactions are looked up in the store indexes when needed, and the
+        UTXO database and filters next to it only need the blocks they haven't seen yet.
+        @param store: BlockStore instance.
+        @param mempool: Mempool for the pending transactions. Default size cap if None.
+        @return: Blockchain instance.
+        """
+        utxo = UtxoSet(os.path.join(store.directory, "utxo.db"))
+        filters = BlockFilterIndex(os.path.join(store.directory, "filters.dat"))
+        blockchain = Blockchain(store, utxo, filters, mempool)
+
+        # UTXO set ahead of the chain - it has to be rebuilt.
+        if utxo.height > len(store):
+            utxo.clear()
+
+        for block_idx in range(utxo.height, len(store)):
+            with utxo.batch(block_idx + 1):
+                blockchain._update_utxo(store[block_idx])
+
+        filters.truncate(len(store))
+        for block_idx in range(len(filters), len(store)):
+            filters.append(block_filter(store[block_idx]))
+
+        return blockchain
 
     def create_genesis_block(self, first_wallet, coinbase):
-        amount = 21000000
+        amount = GENESIS_AMOUNT
 
         genesis_tx = CoinTX(coinbase.pk_str, first_wallet.pk_str, amount, [])
-        genesis_block = Block(0, [genesis_tx], "0")
-
+        genesis_tx.tx_outputs = [TransactionOutput(apply_sha256(first_wallet.pk_str), amount, genesis_tx.tx_id, 0)]
         coinbase.sign_transaction(genesis_tx)
 
-        self.utxo.add(TransactionOutput(apply_sha256(first_wallet.pk_str), amount, genesis_tx.tx_id, 0))
-        self.tx_position[genesis_tx.tx_id] = TXPosition(0, 0)
+        # Genesis has a real header but no proof of work.
+        header = BlockHeader(previous_block_hash=GENESIS_PREVIOUS_HASH,
+                             merkle_root=merkle_root([genesis_tx]),
+                             encoding=self.header_encoding)
+
+        self.add_block(Block(0, [genesis_tx], header))
+
+    def add_block(self, block):
+        """
+        Appends a block to the chain and updates the UTXO set, transaction positions and block filters.
+        Raises InvalidBlockError and changes nothing if the block spends outputs it can't spend.
+        @param block: Block instance.
+        """
+        self.check_transactions(block)
+        block_idx = len(self.chain)
+
+        # All UTXO changes of the block are written at once, or not at all.
+        with self.utxo.batch(block_idx + 1):
+            self._update_utxo(block)
+
+        if not isinstance(self.chain, BlockStore):
+            for tx_idx, transaction in enumerate(block.transactions):
+                self.tx_position[transaction.tx_id] = TXPosition(block_idx, tx_idx)
+            self.block_heights[block.hash] = block_idx
+
+        self.chain.append(block)
+        self.filters.append(block_filter(block))
+
+    def check_transactions(self, block):
+        """
+        Checks the transactions of a block against the UTXO set, like a node checks a new transaction.
+        Every input is unspent and owned by the sender, the inputs cover the amount and the outputs
+        are the ones derived from the inputs. Outputs of earlier transactions in the block can be spent.
+        Raises InvalidBlockError.
+        @param block: Block instance.
+        """
+        created = {}
+        spent = set()
+
+        for transaction in block.transactions:
+            self._check_transaction(transaction, created, spent)
+
+    def invalid_transactions(self, transactions):
+        """
+        The transactions that check_transactions() rejects, e.g. to drop them from the mempool.
+        @param transactions: Transactions in block order.
+        @return: List of the invalid transactions, including the ones that spend their outputs.
+        """
+        created = {}
+        spent = set()
+        invalid = []
+
+        for transaction in transactions:
+            try:
+                self._check_transaction(transaction, created, spent)
+            except InvalidBlockError:
+                invalid.append(transaction)
+
+        return invalid
+
+    def _check_transaction(self, transaction, created, spent):
+        """
+        Checks a transaction after the ones before it in the block, then adds its outputs and inputs.
+        @param created: Outputs of the earlier transactions by outpoint.
+        @param spent: Outpoints spent by the earlier transactions.
+        """
+        if not isinstance(transaction, CoinTX):
+            return
+
+        try:
+            if any(tx_input.outpoint in spent for tx_input in transaction.tx_inputs):
+                raise InvalidTransactionError("Output spent twice in the block")
+            outputs = self.check_transaction(transaction, lambda output: created.get(output.outpoint) == output)
+        except InvalidTransactionError as e:
+            raise InvalidBlockError(e.message + ": " + transaction.tx_id)
+
+        if transaction.tx_outputs != outputs:
+            raise InvalidBlockError("Outputs do not match the inputs: " + transaction.tx_id)
+
+        spent.update(tx_input.outpoint for tx_input in transaction.tx_inputs)
+        for output in outputs:
+            created[output.outpoint] = output
+
+    def check_transaction(self, transaction, is_unspent=None):
+        """
+        Checks the inputs of a CoinTX against the UTXO set, for new transactions and the transactions of a block.
+        The inputs are distinct unspent outputs of the sender and cover the amount, which is positive.
+        Only the genesis transaction has no inputs. Signatures are not checked.
+        Raises InvalidTransactionError.
+        @param transaction: CoinTX instance.
+        @param is_unspent: Function telling if an output outside the UTXO set is unspent, e.g. pending outputs.
+        @return: List of the outputs the transaction creates.
+        """
+        if not transaction.amount > 0:
+            raise InvalidTransactionError("Amount is not positive")
+
+        # Coins are only created by the genesis block.
+        if not transaction.tx_inputs:
+            if len(self.chain) > 0:
+                raise InvalidTransactionError("Transaction without inputs")
+            return [TransactionOutput(apply_sha256(transaction.receiver), transaction.amount, transaction.tx_id, 0)]
+
+        sender = apply_sha256(transaction.sender)
+        tx_total = 0
+        inputs = set()
+
+        for input_tx in transaction.tx_inputs:
+
+            if input_tx.receiver != sender:
+                raise InvalidTransactionError("Input not owned by the sender")
+            if input_tx.outpoint in inputs:
+                raise InvalidTransactionError("Output spent twice by the transaction")
+            if input_tx not in self.utxo and not (is_unspent is not None and is_unspent(input_tx)):
+                raise InvalidTransactionError("Input is not unspent")
+
+            inputs.add(input_tx.outpoint)
+            tx_total += input_tx.amount
+
+        if tx_total < transaction.amount:
+            raise InvalidTransactionError("Inputs do not cover the amount")
+
+        return transaction.create_outputs(tx_total)
+
+    def replace(self, other):
+        """
+        Takes over the blocks, outputs and filters of another blockchain, e.g. one downloaded from a peer.
+        Pending transactions are dropped, they may not fit the new chain.
+        @param other: Blockchain instance. Not to be used afterwards.
+        """
+        self.chain = other.chain
+        self.utxo = other.utxo
+        self.filters = other.filters
+        self.tx_position = other.tx_position
+        self.data_position = other.data_position
+        self.block_heights = other.block_heights
+        self.memory_pool.clear()
+
+    def close(self):
+        """
+        Closes the files of a chain kept on disk.
+        """
+        if isinstance(self.chain, BlockStore):
+            self.chain.close()
+        self.utxo.close()
+        self.filters.close()
+
+    def _update_utxo(self, block):
+        for transaction in block.transactions:
+
+            if not isinstance(transaction, CoinTX):
+                continue
+
+            # Add outputs as unspent.
+            for utxo in transaction.tx_outputs:
+                self.utxo.add(utxo)
+            # Remove utxo that now are spent.
+            for input_tx in transaction.tx_inputs:
+                self.utxo.remove(input_tx)
+
+    def remove_from_mempool(self, transactions):
+        """
+        Removes transactions that are now in a block from the mempool,
+        and the pending transactions that spend the same outputs as them.
+        @param transactions: Transactions of the block.
+        """
+        for transaction in transactions:
+            self.memory_pool.remove(transaction.tx_id)
+
+            for tx_input in getattr(transaction, "tx_inputs", ()):
+                conflict = self.memory_pool.spender(tx_input.outpoint)
+                if conflict is not None:
+                    self.memory_pool.remove_with_descendants(conflict)
+
+    def has_transaction(self, tx_id):
+        """
+        @return: True if the transaction is in the chain or the mempool.
+        """
+        return tx_id in self.memory_pool or self.position_of(tx_id) is not None
+
+    def get_transaction(self, tx_id):
+        """
+        Finds a transaction in the chain or the mempool.
+        @param tx_id: Transaction id.
+        @return: Transaction instance or None.
+        """
+        transaction = self.memory_pool.get(tx_id)
+        if transaction is not None:
+            return transaction
+
+        position = self.position_of(tx_id)
+        if position is None:
+            return None
+
+        return self.chain[position.block_idx].transactions[position.tx_idx]
+
+    def position_of(self, tx_id):
+        """
+        @param tx_id: Transaction id.
+        @return: TXPosition of the transaction in the chain or None.
+        """
+        if isinstance(self.chain, BlockStore):
+            position = self.chain.tx_position(tx_id)
+            return None if position is None else TXPosition(*position)
+        return self.tx_position.get(tx_id)
+
+    def has_block(self, block_hash):
+        return self.height_of(block_hash) is not None
 
-        genesis_block.hash = genesis_block.compute_hash()
-        self.chain.append(genesis_block)
+    def get_block(self, block_hash):
+        """
+        @param block_hash: Block hash.
+        @return: Block instance or None.
+        """
+        height = self.height_of(block_hash)
+        if height is None:
+            return None
+        return self.chain[height]
+
+    def height_of(self, block_hash):
+        """
+        @param block_hash: Block hash.
+        @return: Height of the block or None.
+        """
+        if isinstance(self.chain, BlockStore):
+            return self.chain.height_of(block_hash)
+        return self.block_heights.get(block_hash)
+
+    def block_locator(self):
+        """
+        Hashes of the last ten blocks, then exponentially further apart back to genesis.
+        A peer finds the last block both chains have in it with few hashes even for long chains.
+        @return: List of block hashes, newest first.
+        """
+        locator = []
+        height = len(self.chain) - 1
+        step = 1
+
+        while height > 0:
+            locator.append(self.block_hash(height))
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+
+        locator.append(self.block_hash(0))
+        return locator
+
+    def block_hash(self, height):
+        """
+        @param height: Block height.
+        @return: Block hash, without decoding blocks kept in a block store.
+        """
+        if isinstance(self.chain, BlockStore):
+            return self.chain.hash_at(height)
+        return self.chain[height].hash
+
+    def serialized_block(self, height):
+        """
+        Blocks kept in a block store are returned as stored, without decoding them.
+        @param height: Block height.
+        @return: Block as JSON string.
+        """
+        if isinstance(self.chain, BlockStore):
+            return self.chain.read_raw(height).decode()
+        return self.chain[height].serialize()
+
+    def serialized_header(self, height):
+        """
+        Headers of blocks kept in a block store are read without the blocks.
+        @param height: Block height.
+        @return: Header as JSON string.
+        """
+        if isinstance(self.chain, BlockStore):
+            return self.chain.read_header(height).decode()
+        return json.dumps(self.chain[height].header.to_dict())
 
     @property
     def last_block(self):
         return self.chain[-1]
 
     @classmethod
-    def is_valid_proof(cls, block, block_hash):
+    def is_valid_proof(cls, block):
         """
-        Check if block_hash is valid hash of block and satisfies
-        the difficulty criteria.
+        Check if the block hash satisfies the difficulty criteria.
+        The hash of a block is the hash of its header, so it's computed only once.
         """
-        return (block_hash.startswith('0' * Blockchain.difficulty) and
-                block_hash == block.compute_hash())
+        return block.hash.startswith('0' * Blockchain.difficulty)
 
     @classmethod
     def check_chain_validity(cls, chain):
-
-        result = True
-        previous_hash = "0"
+        """
+        Checks that every block builds on the previous one and has a valid proof of work.
+        Costs one header hash per block, when the block is created.
+        @param chain: Blockchain instance.
+        @return: True if valid.
+        """
+        previous_hash = GENESIS_PREVIOUS_HASH
 
         for block in chain.chain:
 
-            block_hash = block.hash
-            delattr(block, "hash")
-
-            if not cls.is_valid_proof(block, block_hash) or previous_hash != block.previous_hash:
-                result = False
-                break
+            if block.header.previous_block_hash != previous_hash:
+                return False
+            if block.index > 0 and not cls.is_valid_proof(block):
+                return False
 
-            block.hash, previous_hash = block_hash, block_hash
+            previous_hash = block.hash
 
         print("Chain is valid")
-        return result
+        return True
 
     def __iter__(self):
         return iter(self.chain)
@@ -5,6 +5,27 @@ class BlockHashError(Exception):
         super().__init__(self.message)
 
 
+class InvalidBlockError(Exception):
+
+    def __init__(self, message="Block does not fit on the chain."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidTransactionError(Exception):
+
+    def __init__(self, message="Transaction does not spend its inputs correctly."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class SyncError(Exception):
+
+    def __init__(self, message="Failed to download the chain from peers."):
+        self.message = message
+        super().__init__(self.message)
+
+
 class UtxoNotFoundError(Exception):
 
     def __init__(self, message="UTXO was not found on blockchain."):
@@ -17,3 +38,17 @@ class UtxoError(Exception):
     def __init__(self, message="UTXO error."):
         self.message = message
         super().__init__(self.message)
+
+
+class MempoolFullError(Exception):
+
+    def __init__(self, message="Mempool is full and the transaction pays too little to evict others."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class MempoolConflictError(Exception):
+
+    def __init__(self, message="Transaction spends an output that a pending transaction already spends."):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,158 @@
+import mmap
+import os
+import struct
+import threading
+
+from util.gcs import GCSFilter
+
+# Filter record: number of items and length of the encoded filter.
+_FILTER_RECORD = struct.Struct("<II")
+# Filter index record: offset of the encoded filter in the filter file, number of items and length.
+_FILTER_INDEX_RECORD = struct.Struct("<QII")
+
+
+def block_filter(block):
+    """
+    Compact filter of every address a block pays to or spends from.
+    @param block: Block instance.
+    @return: GCSFilter keyed by the block hash.
+    """
+    receivers = set()
+
+    for transaction in block.transactions:
+        for output in getattr(transaction, "tx_outputs", ()):
+            receivers.add(output.receiver)
+        for tx_input in getattr(transaction, "tx_inputs", ()):
+            receivers.add(tx_input.receiver)
+
+    return GCSFilter.build(filter_key(block.hash), receivers)
+
+
+def filter_key(block_hash):
+    return bytes.fromhex(block_hash)[:16]
+
+
+class BlockFilterIndex:
+
+    def __init__(self, path=None):
+        """
+        Compact filters of all blocks by height.
+        Filters on disk are located through fixed size index records next to the filter file,
+        like blocks in a BlockStore, and only read when they are requested.
+        @param path: Append-only file the filters are kept in. Only kept in RAM if None.
+        """
+        self._filters = []
+        self._lock = threading.Lock()
+        self._file = None
+        self._index_file = None
+        self._index_map = None
+        self._length = 0
+
+        if path is not None:
+            self._file = open(path, "a+b")
+            self._index_file = open(os.path.splitext(path)[0] + ".idx", "a+b")
+            self._load()
+
+    def append(self, gcs_filter):
+        with self._lock:
+            if self._file is None:
+                self._filters.append((gcs_filter.n, gcs_filter.data))
+                return
+
+            offset = os.fstat(self._file.fileno()).st_size + _FILTER_RECORD.size
+            self._file.write(_FILTER_RECORD.pack(gcs_filter.n, len(gcs_filter.data)) + gcs_filter.data)
+            self._file.flush()
+
+            # The filter is only part of the index once its record is written.
+            self._index_file.write(_FILTER_INDEX_RECORD.pack(offset, gcs_filter.n, len(gcs_filter.data)))
+            self._index_file.flush()
+            self._length += 1
+            self._map_index()
+
+    def get(self, height, block_hash):
+        """
+        @param height: Block height.
+        @param block_hash: Hash of the block, the key of its filter.
+        @return: GCSFilter instance.
+        """
+        with self._lock:
+            if self._file is None:
+                n, data = self._filters[height]
+            else:
+                if not 0 <= height < self._length:
+                    raise IndexError("Filter height out of range: " + str(height))
+                offset, n, length = _FILTER_INDEX_RECORD.unpack_from(self._index_map,
+                                                                     height * _FILTER_INDEX_RECORD.size)
+                data = os.pread(self._file.fileno(), length, offset)
+
+        return GCSFilter(filter_key(block_hash), n, data)
+
+    def truncate(self, height):
+        """
+        Removes the filters from the given height and up.
+        """
+        with self._lock:
+            if self._file is None:
+                del self._filters[height:]
+                return
+
+            if height >= self._length:
+                return
+
+            offset = _FILTER_INDEX_RECORD.unpack_from(self._index_map, height * _FILTER_INDEX_RECORD.size)[0]
+            self._index_file.truncate(height * _FILTER_INDEX_RECORD.size)
+            self._file.truncate(offset - _FILTER_RECORD.size)
+            self._length = height
+            self._map_index()
+
+    def close(self):
+        if self._file is not None:
+            if self._index_map is not None:
+                self._index_map.close()
+            self._index_file.close()
+            self._file.close()
+
+    def _load(self):
+        size = os.fstat(self._index_file.fileno()).st_size
+        self._index_file.truncate(size - size % _FILTER_INDEX_RECORD.size)
+        self._length = size // _FILTER_INDEX_RECORD.size
+        file_size = os.fstat(self._file.fileno()).st_size
+
+        # Index records of filters that never made it to the filter file.
+        end = 0
+        while self._length > 0:
+            self._index_file.seek((self._length - 1) * _FILTER_INDEX_RECORD.size)
+            offset, _, length = _FILTER_INDEX_RECORD.unpack(self._index_file.read(_FILTER_INDEX_RECORD.size))
+            end = offset + length
+            if end <= file_size:
+                break
+            self._length -= 1
+            end = 0
+        self._index_file.truncate(self._length * _FILTER_INDEX_RECORD.size)
+
+        # Filters written before a crash or without an index file are indexed from the filter file.
+        self._index_file.seek(0, os.SEEK_END)
+        while end + _FILTER_RECORD.size <= file_size:
+            n, length = _FILTER_RECORD.unpack(os.pread(self._file.fileno(), _FILTER_RECORD.size, end))
+            if end + _FILTER_RECORD.size + length > file_size:
+                break
+            self._index_file.write(_FILTER_INDEX_RECORD.pack(end + _FILTER_RECORD.size, n, length))
+            self._length += 1
+            end += _FILTER_RECORD.size + length
+        self._index_file.flush()
+
+        # Drop a half written filter from a crash during append.
+        self._file.truncate(end)
+        self._map_index()
+
+    def _map_index(self):
+        if self._index_map is not None:
+            self._index_map.close()
+
+        size = self._length * _FILTER_INDEX_RECORD.size
+        self._index_map = mmap.mmap(self._index_file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        if self._file is None:
+            return len(self._filters)
+        return self._length
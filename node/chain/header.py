@@ -1,40 +1,185 @@
 import json
+import struct
 import time
 from hashlib import sha256
 
+from node.chain.exceptions import BlockHashError
 from util.serialize import JsonSerializable
 
+# Header encodings used for hashing. Every header carries its encoding,
+# so blocks hashed with either one can be validated by any node.
+HEADER_ENCODING_JSON = 0
+HEADER_ENCODING_BINARY = 1
+SUPPORTED_HEADER_ENCODINGS = (HEADER_ENCODING_JSON, HEADER_ENCODING_BINARY)
+
+# Binary layout: encoding version, previous block hash, merkle root, time stamp | nonce.
+_BINARY_PREFIX = struct.Struct("<I32s32sd")
+_BINARY_NONCE = struct.Struct("<Q")
+BINARY_HEADER_SIZE = _BINARY_PREFIX.size + _BINARY_NONCE.size
+
 
 class BlockHeader:
 
-    def __init__(self, previous_block_hash, merkle_root):
+    def __init__(self, previous_block_hash, merkle_root, encoding=HEADER_ENCODING_JSON):
         """
         Summary of all relevant parts of the block.
         All these will be used in the hashing process when mining a new block.
         @param previous_block_hash: Previous block to build on.
         @param merkle_root: Merkle root of all transactions.
+        @param encoding: Encoding used when hashing the header.
         """
+        if encoding not in SUPPORTED_HEADER_ENCODINGS:
+            raise ValueError("Unsupported header encoding: " + str(encoding))
+
         self.version = 0.01
         self.merkle_root = merkle_root
         self.previous_block_hash = previous_block_hash
         self.time_stamp = time.time()
         self.nonce = 0
+        self.encoding = encoding
 
     @classmethod
-    def from_json(cls, previous_block_hash, merkle_root, time_stamp, nonce):
-        header = BlockHeader(previous_block_hash, merkle_root)
+    def from_json(cls, previous_block_hash, merkle_root, time_stamp, nonce, encoding=HEADER_ENCODING_JSON):
+        header = BlockHeader(previous_block_hash, merkle_root, int(encoding))
         header.time_stamp = time_stamp
-        header.nonce = nonce
+        header.nonce = int(nonce)
         return header
 
+    @classmethod
+    def from_dict(cls, header_data):
+        """
+        @param header_data: Header as serialized by serialize().
+        @return: BlockHeader instance.
+        """
+        return cls.from_json(header_data["previous_block_hash"],
+                             header_data["merkle_root"],
+                             header_data["time_stamp"],
+                             header_data["nonce"],
+                             header_data.get("encoding", HEADER_ENCODING_JSON))
+
+    @classmethod
+    def read_binary(cls, reader):
+        encoding = reader.read_uint()
+        header = BlockHeader(reader.read_hash(), reader.read_hash(), encoding)
+        header.version = reader.read_double()
+        header.time_stamp = reader.read_double()
+        header.nonce = reader.read_uint()
+        return header
+
+    def write_binary(self, writer):
+        """
+        Wire encoding, unlike to_bytes() it keeps the header encoding and version.
+        """
+        writer.write_uint(self.encoding)
+        writer.write_hash(self.previous_block_hash)
+        writer.write_hash(self.merkle_root)
+        writer.write_double(self.version)
+        writer.write_double(self.time_stamp)
+        writer.write_uint(self.nonce)
 
     def compute_hash(self) -> str:
-        block_string = json.dumps(self.__dict__, default=JsonSerializable.dumper)
+        if self.encoding == HEADER_ENCODING_BINARY:
+            return sha256(self.to_bytes()).hexdigest()
+
+        block_string = json.dumps(self._json_fields(), default=JsonSerializable.dumper)
         return sha256(block_string.encode()).hexdigest()
 
+    def hash_template(self):
+        """
+        Creates a template that hashes this header for any nonce.
+        @return: HeaderTemplate instance.
+        """
+        return HeaderTemplate(self)
+
+    def to_bytes(self):
+        """
+        Fixed layout binary encoding of the header.
+        @return: Header as bytes.
+        """
+        return self._binary_prefix() + _BINARY_NONCE.pack(self.nonce)
+
     def serialize(self):
-        return json.loads(json.dumps({"merkle_root": self.merkle_root,
-                                      "previous_block_hash": self.previous_block_hash,
-                                      "time_stamp": self.time_stamp,
-                                      "nonce": str(self.nonce)
-                                      }, default=JsonSerializable.dumper, indent=4))
+        return self.to_dict()
+
+    def to_dict(self):
+        return {"merkle_root": self.merkle_root,
+                "previous_block_hash": self.previous_block_hash,
+                "time_stamp": self.time_stamp,
+                "nonce": str(self.nonce),
+                "encoding": self.encoding}
+
+    def _json_fields(self):
+        # Same fields and order as the original header hash, the nonce must stay last.
+        return {"version": self.version,
+                "merkle_root": self.merkle_root,
+                "previous_block_hash": self.previous_block_hash,
+                "time_stamp": self.time_stamp,
+                "nonce": self.nonce}
+
+    def _binary_prefix(self):
+        return _BINARY_PREFIX.pack(HEADER_ENCODING_BINARY,
+                                   _hash_to_bytes(self.previous_block_hash),
+                                   _hash_to_bytes(self.merkle_root),
+                                   self.time_stamp)
+
+
+class HeaderTemplate:
+
+    def __init__(self, header):
+        """
+        Hashes everything but the nonce once and keeps the SHA-256 midstate.
+        Each nonce attempt then only copies the midstate and appends the nonce.
+        @param header: BlockHeader instance.
+        """
+        self.encoding = header.encoding
+        self._midstate = sha256()
+
+        if self.encoding == HEADER_ENCODING_BINARY:
+            self._midstate.update(header._binary_prefix())
+        else:
+            fields = header._json_fields()
+            del fields["nonce"]
+            prefix = json.dumps(fields, default=JsonSerializable.dumper)[:-1] + ', "nonce": '
+            self._midstate.update(prefix.encode())
+
+    def hash_nonce(self, nonce) -> str:
+        sha = self._midstate.copy()
+
+        if self.encoding == HEADER_ENCODING_BINARY:
+            sha.update(_BINARY_NONCE.pack(nonce))
+        else:
+            sha.update(b"%d}" % nonce)
+
+        return sha.hexdigest()
+
+
+def check_header(header, block_hash, previous_hash, difficulty):
+    """
+    Checks one header of a header chain, raises BlockHashError if it's invalid.
+    @param header: BlockHeader instance.
+    @param block_hash: Hash the block is known by.
+    @param previous_hash: Hash of the block before it in the chain.
+    @param difficulty: Number of leading zeros the hash needs. 0 for genesis.
+    """
+    computed_hash = header.compute_hash()
+
+    if computed_hash != block_hash:
+        raise BlockHashError("Block hash does not match its header: " + block_hash)
+    if header.previous_block_hash != previous_hash:
+        raise BlockHashError("Header does not build on the previous block: " + block_hash)
+    if not computed_hash.startswith('0' * difficulty):
+        raise BlockHashError("Header does not meet the difficulty: " + block_hash)
+
+
+def negotiate_encoding(remote_encodings):
+    """
+    Picks the newest header encoding supported by both this node and a peer.
+    @param remote_encodings: Encodings supported by the peer.
+    @return: Header encoding.
+    """
+    common = set(SUPPORTED_HEADER_ENCODINGS).intersection(int(encoding) for encoding in remote_encodings)
+    return max(common, default=HEADER_ENCODING_JSON)
+
+
+def _hash_to_bytes(hex_hash):
+    return bytes.fromhex(hex_hash.zfill(64))
@@ -0,0 +1,342 @@
+import heapq
+import itertools
+import threading
+
+from node.chain.exceptions import MempoolFullError, MempoolConflictError
+from util.wire import BinaryWriter
+
+# Size cap of the mempool in bytes of encoded transactions.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def tx_size(transaction):
+    """
+    @param transaction: Transaction instance.
+    @return: Size of the transaction in the binary wire format.
+    """
+    writer = BinaryWriter()
+    transaction.write_binary(writer)
+    return len(writer.to_bytes())
+
+
+class MempoolEntry:
+
+    __slots__ = ("tx", "fee", "size", "sequence")
+
+    def __init__(self, tx, fee, size, sequence):
+        """
+        @param tx: Transaction instance.
+        @param fee: Fee paid to the miner.
+        @param size: Size in bytes, see tx_size().
+        @param sequence: Arrival order in the mempool.
+        """
+        self.tx = tx
+        self.fee = fee
+        self.size = size
+        self.sequence = sequence
+
+    @property
+    def fee_rate(self):
+        return self.fee / self.size
+
+    @property
+    def priority(self):
+        """
+        Sort key, highest fee rate first and older transactions first on equal fee rates.
+        """
+        return -self.fee_rate, self.sequence
+
+
+class Mempool:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, replace_by_fee=False):
+        """
+        Pending transactions, capped in bytes.
+        When the cap is reached the transactions with the lowest fee rate are evicted,
+        the newest first on equal fee rates. Transactions are indexed by id, by the
+        outputs they spend and by sender, so none of the lookups scan the pool.
+        Two pending transactions never spend the same output.
+        @param max_bytes: Size cap in bytes.
+        @param replace_by_fee: Let a transaction replace the pending transactions it conflicts with
+                               if it pays more fees than all of them and a higher fee rate.
+        """
+        self.max_bytes = max_bytes
+        self.replace_by_fee = replace_by_fee
+        self.size_bytes = 0
+        self.total_fees = 0.0
+        self._entries = {}
+        self._spenders = {}
+        self._by_sender = {}
+        # Lowest priority on top. Removed entries are skipped when they come up.
+        self._eviction_heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.RLock()
+
+    def add(self, transaction, fee=0.0):
+        """
+        Adds a transaction and evicts the lowest priority transactions if the pool is full.
+        Raises MempoolConflictError if it spends an output a pending transaction spends,
+        unless it replaces that transaction, see check_conflicts(). Raises MempoolFullError
+        and leaves the pool as it was if the transaction would be evicted itself.
+        @param transaction: Transaction instance.
+        @param fee: Fee paid to the miner.
+        @return: List of replaced and evicted transactions.
+        """
+        with self._lock:
+            if transaction.tx_id in self._entries:
+                return []
+
+            removed = self._remove_entries(self.check_conflicts(transaction, fee))
+
+            entry = MempoolEntry(transaction, fee, tx_size(transaction), next(self._sequence))
+            self._insert(entry)
+            removed += self._trim()
+
+            # The new transaction had the lowest priority itself, nothing it replaced or evicted is lost.
+            if transaction.tx_id not in self._entries:
+                self._restore([removed_entry for removed_entry in removed if removed_entry is not entry])
+                raise MempoolFullError()
+
+            return [removed_entry.tx for removed_entry in removed]
+
+    def check_conflicts(self, transaction, fee=0.0):
+        """
+        Finds the pending transactions that spend the same outputs, one lookup per input.
+        Cheap enough to be called before the signatures of the transaction are checked.
+        @param transaction: Transaction instance.
+        @param fee: Fee paid to the miner.
+        @return: Ids of the pending transactions the transaction replaces.
+        """
+        with self._lock:
+            conflicts = []
+            for outpoint in _spent_outpoints(transaction):
+                tx_id = self._spenders.get(outpoint)
+                if tx_id is not None and tx_id != transaction.tx_id and tx_id not in conflicts:
+                    conflicts.append(tx_id)
+
+            if not conflicts:
+                return []
+            if not self.replace_by_fee:
+                raise MempoolConflictError()
+
+            replaced = self._descendants(conflicts)
+            fee_rate = fee / tx_size(transaction)
+
+            if any(tx_input.parent_tx_id in replaced for tx_input in transaction.tx_inputs):
+                raise MempoolConflictError("Transaction spends outputs of the transactions it replaces.")
+            if fee <= sum(self._entries[tx_id].fee for tx_id in replaced):
+                raise MempoolConflictError("Replacement pays less fees than the transactions it replaces.")
+            if any(fee_rate <= self._entries[tx_id].fee_rate for tx_id in conflicts):
+                raise MempoolConflictError("Replacement has a lower fee rate than the transactions it replaces.")
+
+            return conflicts
+
+    def remove(self, tx_id):
+        """
+        @param tx_id: Transaction id.
+        @return: Removed transaction or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(tx_id, None)
+            if entry is None:
+                return None
+
+            self.size_bytes -= entry.size
+            # Float sums drift, an empty pool has no fees.
+            self.total_fees = self.total_fees - entry.fee if self._entries else 0.0
+
+            for outpoint in _spent_outpoints(entry.tx):
+                if self._spenders.get(outpoint) == tx_id:
+                    del self._spenders[outpoint]
+
+            sender = getattr(entry.tx, "sender", None)
+            if sender is not None:
+                sender_txs = self._by_sender[sender]
+                sender_txs.discard(tx_id)
+                if not sender_txs:
+                    del self._by_sender[sender]
+
+            self._compact_heap()
+            return entry.tx
+
+    def remove_with_descendants(self, tx_id):
+        """
+        Removes a transaction and every transaction in the pool that spends its outputs.
+        @param tx_id: Transaction id.
+        @return: List of removed transactions.
+        """
+        with self._lock:
+            return [entry.tx for entry in self._remove_entries([tx_id])]
+
+    def get(self, tx_id):
+        """
+        @param tx_id: Transaction id.
+        @return: Transaction instance or None.
+        """
+        entry = self._entries.get(tx_id)
+        return entry.tx if entry is not None else None
+
+    def entry(self, tx_id):
+        return self._entries.get(tx_id)
+
+    def has_output(self, output):
+        """
+        @param output: TransactionOutput instance.
+        @return: True if a transaction in the pool created the output.
+        """
+        entry = self._entries.get(output.parent_tx_id)
+        if entry is None:
+            return False
+
+        outputs = getattr(entry.tx, "tx_outputs", ())
+        return output.vout < len(outputs) and outputs[output.vout] == output
+
+    def spender(self, outpoint):
+        """
+        @param outpoint: OutPoint of an output.
+        @return: Id of the transaction in the pool that spends the output, or None.
+        """
+        return self._spenders.get(outpoint)
+
+    def from_sender(self, sender):
+        """
+        @param sender: Public key of the sender.
+        @return: List of the pending transactions of the sender, in arrival order.
+        """
+        with self._lock:
+            entries = [self._entries[tx_id] for tx_id in self._by_sender.get(sender, ())]
+
+        return [entry.tx for entry in sorted(entries, key=lambda entry: entry.sequence)]
+
+    def by_priority(self):
+        """
+        @return: List of entries, highest fee rate first.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+
+        return sorted(entries, key=lambda entry: entry.priority)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._spenders.clear()
+            self._by_sender.clear()
+            self._eviction_heap.clear()
+            self.size_bytes = 0
+            self.total_fees = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {"transactions": len(self._entries),
+                    "bytes": self.size_bytes,
+                    "max_bytes": self.max_bytes,
+                    "fees": self.total_fees,
+                    "min_fee_rate": self._lowest()[0] if self._entries else 0.0}
+
+    def _descendants(self, tx_ids):
+        """
+        @param tx_ids: Ids of pending transactions.
+        @return: The ids and the ids of every pending transaction spending their outputs, parents first.
+        """
+        found = {}
+        pending = [tx_id for tx_id in tx_ids if tx_id in self._entries]
+
+        while pending:
+            tx_id = pending.pop(0)
+            if tx_id in found:
+                continue
+
+            found[tx_id] = None
+            for output in getattr(self._entries[tx_id].tx, "tx_outputs", ()):
+                child_id = self._spenders.get(output.outpoint)
+                if child_id is not None:
+                    pending.append(child_id)
+
+        return list(found)
+
+    def _insert(self, entry):
+        tx_id = entry.tx.tx_id
+
+        self._entries[tx_id] = entry
+        self.size_bytes += entry.size
+        self.total_fees += entry.fee
+        heapq.heappush(self._eviction_heap, (entry.fee_rate, -entry.sequence, tx_id))
+
+        for outpoint in _spent_outpoints(entry.tx):
+            self._spenders[outpoint] = tx_id
+
+        sender = getattr(entry.tx, "sender", None)
+        if sender is not None:
+            self._by_sender.setdefault(sender, set()).add(tx_id)
+
+    def _remove_entries(self, tx_ids):
+        """
+        Removes transactions and their descendants.
+        @return: List of the removed entries, parents first.
+        """
+        entries = [self._entries[tx_id] for tx_id in self._descendants(tx_ids)]
+
+        for entry in entries:
+            self.remove(entry.tx.tx_id)
+
+        return entries
+
+    def _restore(self, entries):
+        if not entries:
+            return
+
+        for entry in entries:
+            self._insert(entry)
+
+        # Back in arrival order, see __iter__.
+        self._entries = dict(sorted(self._entries.items(), key=lambda item: item[1].sequence))
+
+    def _trim(self):
+        """
+        @return: List of the evicted entries.
+        """
+        evicted = []
+
+        while self.size_bytes > self.max_bytes and self._lowest() is not None:
+            _, _, tx_id = heapq.heappop(self._eviction_heap)
+            evicted.extend(self._remove_entries([tx_id]))
+
+        return evicted
+
+    def _lowest(self):
+        # Drops removed entries from the top of the heap.
+        while self._eviction_heap:
+            fee_rate, sequence, tx_id = self._eviction_heap[0]
+            entry = self._entries.get(tx_id)
+            if entry is not None and entry.sequence == -sequence:
+                return self._eviction_heap[0]
+            heapq.heappop(self._eviction_heap)
+
+        return None
+
+    def _compact_heap(self):
+        # Removed entries stay in the heap until popped, rebuild it when most of it is stale.
+        if len(self._eviction_heap) > 2 * len(self._entries) + 64:
+            self._eviction_heap = [(entry.fee_rate, -entry.sequence, tx_id) for tx_id, entry in self._entries.items()]
+            heapq.heapify(self._eviction_heap)
+
+    def __contains__(self, item):
+        """
+        @param item: Transaction instance or transaction id.
+        """
+        return getattr(item, "tx_id", item) in self._entries
+
+    def __iter__(self):
+        """
+        Transactions in arrival order, so parents come before the transactions spending them.
+        """
+        with self._lock:
+            return iter([entry.tx for entry in self._entries.values()])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _spent_outpoints(transaction):
+    return [tx_input.outpoint for tx_input in getattr(transaction, "tx_inputs", ())]
@@ -0,0 +1,162 @@
+import abc
+import multiprocessing
+import os
+import time
+from abc import abstractmethod
+from collections import namedtuple
+
+MiningResult = namedtuple("MiningResult", ("nonce", "hash", "hash_rates"))
+
+# Set in every pool worker by _init_worker.
+_stop_event = None
+
+
+class Miner(abc.ABC):
+
+    def __init__(self):
+        self.hash_rates = {}
+
+    @abstractmethod
+    def mine(self, header, difficulty, should_abort=lambda: False):
+        """
+        Search for a nonce that gives the header a hash with enough leading zeros.
+        The nonce of the header will be set to the found value.
+        @param header: BlockHeader instance.
+        @param difficulty: Number of leading zeros needed.
+        @param should_abort: Callable that returns True if the search should stop.
+        @return: MiningResult or None if aborted.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class SingleProcessMiner(Miner):
+
+    def mine(self, header, difficulty, should_abort=lambda: False):
+        target = "0" * difficulty
+        template = header.hash_template()
+        start_nonce = header.nonce
+        start = time.time()
+
+        computed_hash = template.hash_nonce(header.nonce)
+        while not computed_hash.startswith(target):
+            header.nonce += 1
+            computed_hash = template.hash_nonce(header.nonce)
+
+            if should_abort():
+                return None
+
+        self.hash_rates = {0: _hash_rate(header.nonce - start_nonce + 1, time.time() - start)}
+        return MiningResult(header.nonce, computed_hash, self.hash_rates)
+
+
+class ProcessPoolMiner(Miner):
+
+    def __init__(self, workers=None, batch_size=2000, poll_interval=0.01):
+        """
+        Splits the nonce space across a pool of processes.
+        Worker i tries the nonces start + i, start + i + workers, ...
+        @param workers: Number of processes. Defaults to the CPU count.
+        @param batch_size: Hashes tried between each check of the stop flag.
+        @param poll_interval: Seconds between each check for a result or abort.
+        """
+        super().__init__()
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._pool = None
+        self._stop = None
+
+    def _start_pool(self):
+        self._stop = multiprocessing.Event()
+        self._pool = multiprocessing.Pool(self.workers,
+                                          initializer=_init_worker,
+                                          initargs=(self._stop,))
+
+    def mine(self, header, difficulty, should_abort=lambda: False):
+        if self._pool is None:
+            self._start_pool()
+
+        self._stop.clear()
+        target = "0" * difficulty
+        jobs = [self._pool.apply_async(_search_nonce,
+                                       (header, header.nonce + worker, self.workers, target, self.batch_size))
+                for worker in range(self.workers)]
+
+        aborted = False
+        while not any(job.ready() for job in jobs):
+            if should_abort():
+                aborted = True
+                break
+            time.sleep(self.poll_interval)
+
+        # Stop every worker as soon as one is done.
+        self._stop.set()
+        outcomes = [job.get() for job in jobs]
+
+        self.hash_rates = {worker: _hash_rate(hashes, elapsed)
+                           for worker, (_, _, hashes, elapsed) in enumerate(outcomes)}
+
+        found = [(nonce, computed_hash) for nonce, computed_hash, _, _ in outcomes if nonce is not None]
+        if aborted or not found:
+            return None
+
+        nonce, computed_hash = min(found)
+        header.nonce = nonce
+        return MiningResult(nonce, computed_hash, self.hash_rates)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+_miners = {
+    "single": SingleProcessMiner,
+    "pool": ProcessPoolMiner
+}
+
+
+def create_miner(name, **kwargs):
+    """
+    Creates a mining engine given its name.
+    @param name: "single" or "pool".
+    @return: Miner instance.
+    """
+    if name not in _miners:
+        raise ValueError("Unknown miner: " + str(name))
+    return _miners[name](**kwargs)
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search_nonce(header, start_nonce, stride, target, batch_size):
+    """
+    Runs in a pool worker.
+    @return: Tuple of nonce (None if not found), hash, hashes tried and seconds spent.
+    """
+    start = time.time()
+    hash_nonce = header.hash_template().hash_nonce
+    hashes = 0
+    nonce = start_nonce
+
+    while not _stop_event.is_set():
+        for _ in range(batch_size):
+            computed_hash = hash_nonce(nonce)
+            hashes += 1
+
+            if computed_hash.startswith(target):
+                return nonce, computed_hash, hashes, time.time() - start
+
+            nonce += stride
+
+    return None, None, hashes, time.time() - start
+
+
+def _hash_rate(hashes, elapsed):
+    return hashes / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,483 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from node.chain.block import Block
+from util.cache import LRUCache
+from util.serialize import loads
+
+# Block index record: block hash, segment number, offset and length. Height = record number.
+_BLOCK_RECORD = struct.Struct("<32sIQI")
+# Transaction index record: tx id, block height and position in block.
+_TX_RECORD = struct.Struct("<32sII")
+# Header index record: offset and length of the serialized header in the header file. Height = record number.
+_HEADER_RECORD = struct.Struct("<QI")
+# Hash index: capacity, used slots and number of indexed records, then one slot per bucket.
+_HASH_INDEX_HEADER = struct.Struct("<QQQ")
+# Record number + 1, 0 is an empty slot.
+_HASH_INDEX_SLOT = struct.Struct("<I")
+_HASH_INDEX_MIN_CAPACITY = 1024
+
+_BLOCK_INDEX_FILE = "blocks.idx"
+_TX_INDEX_FILE = "tx.idx"
+_BLOCK_HASH_INDEX_FILE = "blocks.hix"
+_TX_HASH_INDEX_FILE = "tx.hix"
+_HEADER_INDEX_FILE = "headers.idx"
+_HEADER_FILE = "headers.dat"
+_SEGMENT_FILE = "blk{:05d}.dat"
+
+
+class BlockStore:
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, cache_size=256):
+        """
+        Append-only block storage.
+        Serialized blocks are appended to segment files and located through
+        fixed size index records, so the index can be memory mapped on startup
+        and blocks are only decoded when they are read. Blocks and transactions
+        are found by hash through hash tables on disk, nothing is loaded per block.
+        Headers are also kept on their own, so they can be served without the blocks.
+        @param directory: Directory for the segment and index files.
+        @param segment_size: Max size of a segment file in bytes.
+        @param cache_size: Number of decoded blocks to keep in memory.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.RLock()
+        self._segments = {}
+
+        self._index_file = open(os.path.join(directory, _BLOCK_INDEX_FILE), "a+b")
+        self._tx_index_file = open(os.path.join(directory, _TX_INDEX_FILE), "a+b")
+        self._header_index_file = open(os.path.join(directory, _HEADER_INDEX_FILE), "a+b")
+        self._header_file = open(os.path.join(directory, _HEADER_FILE), "a+b")
+
+        # Drop a half written record from a crash during append.
+        self._truncate_partial(self._index_file, _BLOCK_RECORD.size)
+        self._truncate_partial(self._tx_index_file, _TX_RECORD.size)
+        self._truncate_partial(self._header_index_file, _HEADER_RECORD.size)
+
+        self._length = os.fstat(self._index_file.fileno()).st_size // _BLOCK_RECORD.size
+        self._index_map = None
+        self._tx_length = 0
+        self._tx_index_map = None
+        self._header_index_map = None
+        self._map_index()
+        self._truncate_unindexed_tx()
+        self._sync_headers()
+
+        self._hash_index = _HashIndex(os.path.join(directory, _BLOCK_HASH_INDEX_FILE), lambda height: self._record(height)[0])
+        self._tx_hash_index = _HashIndex(os.path.join(directory, _TX_HASH_INDEX_FILE), lambda record: self._tx_record(record)[0])
+
+        # Records appended before a crash that the hash indexes missed.
+        self._hash_index.update(self._length)
+        self._tx_hash_index.update(self._tx_length)
+
+        if self._length > 0:
+            self._segment = self._record(self._length - 1)[1]
+        else:
+            self._segment = 0
+
+    def append(self, block):
+        """
+        Writes a block to the end of the store.
+        @param block: Block instance.
+        """
+        data = block.serialize().encode()
+
+        with self._lock:
+            segment = self._open_segment(self._segment)
+            offset = os.fstat(segment.fileno()).st_size
+
+            if offset > 0 and offset + len(data) > self.segment_size:
+                self._segment += 1
+                segment = self._open_segment(self._segment)
+                offset = 0
+
+            segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+
+            height = self._length
+            for position, transaction in enumerate(block.transactions):
+                self._tx_index_file.write(_TX_RECORD.pack(bytes.fromhex(transaction.tx_id), height, position))
+            self._tx_index_file.flush()
+            self._write_header(block)
+
+            # The block is only part of the store once its index record is written.
+            self._index_file.write(_BLOCK_RECORD.pack(bytes.fromhex(block.hash), self._segment, offset, len(data)))
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+
+            self._length += 1
+            self._map_index()
+
+            self._hash_index.update(self._length)
+            self._tx_hash_index.update(self._tx_length)
+
+    def get(self, height):
+        """
+        Reads and decodes the block at a given height.
+        @param height: Block height.
+        @return: Block instance.
+        """
+        if height < 0:
+            height += self._length
+
+        block = self._cache.get(height)
+
+        if block is None:
+            block = Block.from_json(loads(self.read_raw(height)))
+            self._cache.put(height, block)
+
+        return block
+
+    def read_raw(self, height):
+        """
+        @param height: Block height.
+        @return: Serialized block as bytes.
+        """
+        # The segment files may be truncated and closed by another thread.
+        with self._lock:
+            _, segment, offset, length = self._record(height)
+            return os.pread(self._open_segment(segment).fileno(), length, offset)
+
+    def read_header(self, height):
+        """
+        @param height: Block height.
+        @return: Header of the block as JSON bytes, read without the block.
+        """
+        with self._lock:
+            if height < 0:
+                height += self._length
+            if not 0 <= height < self._length:
+                raise IndexError("Block height out of range: " + str(height))
+
+            offset, length = _HEADER_RECORD.unpack_from(self._header_index_map, height * _HEADER_RECORD.size)
+            return os.pread(self._header_file.fileno(), length, offset)
+
+    def height_of(self, block_hash):
+        """
+        @param block_hash: Block hash.
+        @return: Height of the block or None if not stored.
+        """
+        key = _hash_key(block_hash)
+        if key is None:
+            return None
+
+        with self._lock:
+            return self._hash_index.get(key, self._length)
+
+    def hash_at(self, height):
+        """
+        @param height: Block height.
+        @return: Hash of the block, read from the index without decoding the block.
+        """
+        return self._record(height)[0].hex()
+
+    def get_by_hash(self, block_hash):
+        height = self.height_of(block_hash)
+        return None if height is None else self.get(height)
+
+    def tx_position(self, tx_id):
+        """
+        @param tx_id: Transaction id.
+        @return: Tuple of block height and position in block, None if not stored.
+        """
+        key = _hash_key(tx_id)
+        if key is None:
+            return None
+
+        with self._lock:
+            record = self._tx_hash_index.get(key, self._tx_length)
+            if record is None:
+                return None
+
+            _, height, position = self._tx_record(record)
+            return height, position
+
+    def truncate(self, height):
+        """
+        Removes all blocks from the given height and up.
+        @param height: Number of blocks to keep.
+        """
+        with self._lock:
+            if height >= self._length:
+                return
+
+            _, segment, offset, _ = self._record(height)
+
+            self._index_file.truncate(height * _BLOCK_RECORD.size)
+            os.fsync(self._index_file.fileno())
+            self._length = height
+            self._map_index()
+            self._truncate_unindexed_tx()
+            self._sync_headers()
+            self._hash_index.update(self._length)
+            self._tx_hash_index.update(self._tx_length)
+
+            # Segment data after the last kept block.
+            self._open_segment(segment).truncate(offset)
+            for later_segment in sorted(s for s in self._segments if s > segment):
+                self._segments.pop(later_segment).close()
+            for later_segment in range(segment + 1, self._segment + 1):
+                path = os.path.join(self.directory, _SEGMENT_FILE.format(later_segment))
+                if os.path.exists(path):
+                    os.remove(path)
+
+            self._segment = segment
+            self._cache.clear()
+
+    def close(self):
+        with self._lock:
+            if self._index_map is not None:
+                self._index_map.close()
+            if self._tx_index_map is not None:
+                self._tx_index_map.close()
+            if self._header_index_map is not None:
+                self._header_index_map.close()
+            self._hash_index.close()
+            self._tx_hash_index.close()
+            self._index_file.close()
+            self._tx_index_file.close()
+            self._header_index_file.close()
+            self._header_file.close()
+
+            for segment in self._segments.values():
+                segment.close()
+
+    def _record(self, height):
+        # The index maps are replaced on every append, readers run on other threads.
+        with self._lock:
+            if height < 0:
+                height += self._length
+            if not 0 <= height < self._length:
+                raise IndexError("Block height out of range: " + str(height))
+
+            return _BLOCK_RECORD.unpack_from(self._index_map, height * _BLOCK_RECORD.size)
+
+    def _tx_record(self, record):
+        with self._lock:
+            return _TX_RECORD.unpack_from(self._tx_index_map, record * _TX_RECORD.size)
+
+    def _map_index(self):
+        if self._index_map is not None:
+            self._index_map.close()
+        if self._tx_index_map is not None:
+            self._tx_index_map.close()
+        if self._header_index_map is not None:
+            self._header_index_map.close()
+
+        self._index_map = _map_file(self._index_file, self._length * _BLOCK_RECORD.size)
+
+        self._tx_length = os.fstat(self._tx_index_file.fileno()).st_size // _TX_RECORD.size
+        self._tx_index_map = _map_file(self._tx_index_file, self._tx_length * _TX_RECORD.size)
+
+        header_length = os.fstat(self._header_index_file.fileno()).st_size // _HEADER_RECORD.size
+        self._header_index_map = _map_file(self._header_index_file, min(header_length, self._length) * _HEADER_RECORD.size)
+
+    def _open_segment(self, segment):
+        if segment not in self._segments:
+            path = os.path.join(self.directory, _SEGMENT_FILE.format(segment))
+            self._segments[segment] = open(path, "a+b")
+
+        return self._segments[segment]
+
+    def _truncate_unindexed_tx(self):
+        # Tx records are written before the block record, drop the ones of a block that never made it.
+        size = os.fstat(self._tx_index_file.fileno()).st_size
+
+        while size > 0:
+            self._tx_index_file.seek(size - _TX_RECORD.size)
+            _, height, _ = _TX_RECORD.unpack(self._tx_index_file.read(_TX_RECORD.size))
+            if height < self._length:
+                break
+            size -= _TX_RECORD.size
+
+        self._tx_index_file.truncate(size)
+
+        if size // _TX_RECORD.size != self._tx_length:
+            self._map_index()
+
+    def _write_header(self, block):
+        data = json.dumps(block.header.to_dict()).encode()
+        offset = os.fstat(self._header_file.fileno()).st_size
+
+        self._header_file.write(data)
+        self._header_file.flush()
+        self._header_index_file.write(_HEADER_RECORD.pack(offset, len(data)))
+        self._header_index_file.flush()
+
+    def _sync_headers(self):
+        # Header records of blocks that were truncated or never made it.
+        count = os.fstat(self._header_index_file.fileno()).st_size // _HEADER_RECORD.size
+
+        if count > self._length:
+            self._header_index_file.seek(self._length * _HEADER_RECORD.size)
+            offset, _ = _HEADER_RECORD.unpack(self._header_index_file.read(_HEADER_RECORD.size))
+            self._header_index_file.truncate(self._length * _HEADER_RECORD.size)
+            self._header_file.truncate(offset)
+            count = self._length
+
+        # Header file shorter than its index, e.g. lost: rebuild both.
+        if count > 0:
+            self._header_index_file.seek((count - 1) * _HEADER_RECORD.size)
+            offset, length = _HEADER_RECORD.unpack(self._header_index_file.read(_HEADER_RECORD.size))
+            if offset + length > os.fstat(self._header_file.fileno()).st_size:
+                self._header_index_file.truncate(0)
+                count = 0
+
+        # Stores written before the header file, or a lost header file: the headers are read from the blocks once.
+        if count < self._length:
+            if count == 0:
+                self._header_file.truncate(0)
+            for height in range(count, self._length):
+                self._write_header(Block.from_json(loads(self.read_raw(height))))
+
+        self._map_index()
+
+    @staticmethod
+    def _truncate_partial(file, record_size):
+        size = os.fstat(file.fileno()).st_size
+        if size % record_size != 0:
+            file.truncate(size - size % record_size)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.get(height) for height in range(*item.indices(self._length))]
+
+        return self.get(item)
+
+    def __iter__(self):
+        # Blocks are decoded one at a time and not kept in the cache.
+        for height in range(self._length):
+            block = self._cache.get(height)
+            yield block if block is not None else Block.from_json(loads(self.read_raw(height)))
+
+
+class _HashIndex:
+
+    def __init__(self, path, key_at):
+        """
+        Hash table on disk from 32 byte keys to record numbers, memory mapped.
+        The keys are hashes already, so their first bytes pick the bucket. Every hit is
+        checked against the key of the record itself: slots left by a truncate or a crash
+        are skipped, and the file can always be rebuilt from the records.
+        @param path: Index file.
+        @param key_at: Function that returns the key of a record number.
+        """
+        self._path = path
+        self._key_at = key_at
+        self._file = None
+        self._map = None
+        self._open(_HASH_INDEX_MIN_CAPACITY)
+
+    def get(self, key, count):
+        """
+        @param key: Key as bytes.
+        @param count: Number of valid records.
+        @return: Record number or None.
+        """
+        mask = self._capacity - 1
+        slot = int.from_bytes(key[:8], "little") & mask
+
+        while True:
+            value = _HASH_INDEX_SLOT.unpack_from(self._map, _HASH_INDEX_HEADER.size + slot * _HASH_INDEX_SLOT.size)[0]
+            if value == 0:
+                return None
+            if value - 1 < count and self._key_at(value - 1) == key:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def update(self, count):
+        """
+        Adds the records the index hasn't seen yet.
+        @param count: Number of valid records.
+        """
+        # Records were truncated, the next ones get the same numbers.
+        if self._indexed > count:
+            self._indexed = count
+
+        if self._indexed == count:
+            self._write_header()
+            return
+
+        # Keep at least half of the slots empty so probes stay short.
+        if (self._used + count - self._indexed) * 2 > self._capacity:
+            self._rebuild(count)
+            return
+
+        for record in range(self._indexed, count):
+            self._insert(self._key_at(record), record)
+
+        self._indexed = count
+        self._write_header()
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _insert(self, key, record):
+        mask = self._capacity - 1
+        slot = int.from_bytes(key[:8], "little") & mask
+
+        while _HASH_INDEX_SLOT.unpack_from(self._map, _HASH_INDEX_HEADER.size + slot * _HASH_INDEX_SLOT.size)[0]:
+            slot = (slot + 1) & mask
+
+        _HASH_INDEX_SLOT.pack_into(self._map, _HASH_INDEX_HEADER.size + slot * _HASH_INDEX_SLOT.size, record + 1)
+        self._used += 1
+
+    def _rebuild(self, count):
+        capacity = _HASH_INDEX_MIN_CAPACITY
+        while count * 2 > capacity:
+            capacity *= 2
+
+        self.close()
+        os.remove(self._path)
+        self._open(capacity)
+
+        for record in range(count):
+            self._insert(self._key_at(record), record)
+
+        self._indexed = count
+        self._write_header()
+        self._map.flush()
+
+    def _open(self, capacity):
+        self._file = open(self._path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+
+        if size < _HASH_INDEX_HEADER.size:
+            self._file.truncate(0)
+            self._file.write(_HASH_INDEX_HEADER.pack(capacity, 0, 0))
+            self._file.truncate(_HASH_INDEX_HEADER.size + capacity * _HASH_INDEX_SLOT.size)
+            self._file.flush()
+
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._capacity, self._used, self._indexed = _HASH_INDEX_HEADER.unpack_from(self._map, 0)
+
+    def _write_header(self):
+        _HASH_INDEX_HEADER.pack_into(self._map, 0, self._capacity, self._used, self._indexed)
+
+
+def _hash_key(hex_hash):
+    # Hashes from peers and wallets aren't trusted to be hex.
+    try:
+        key = bytes.fromhex(hex_hash)
+    except (TypeError, ValueError):
+        return None
+    return key if len(key) == 32 else None
+
+
+def _map_file(file, size):
+    if size == 0:
+        return None
+    return mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
@@ -0,0 +1,68 @@
+from collections import deque, namedtuple
+
+# Limits of a mined block, transactions that don't fit wait for the next one.
+DEFAULT_MAX_BLOCK_BYTES = 1000000
+DEFAULT_MAX_BLOCK_TX = 2500
+
+BlockTemplate = namedtuple("BlockTemplate", ("transactions", "size", "fees"))
+
+
+class BlockTemplateBuilder:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BLOCK_BYTES, max_tx=DEFAULT_MAX_BLOCK_TX):
+        """
+        Picks the transactions of a candidate block from the mempool.
+        Transactions are taken by fee rate until the block is full. A transaction that spends
+        outputs of pending transactions is only taken once its parents are in the block,
+        and right after them, so the block never spends an output before creating it.
+        @param max_bytes: Size limit of the transactions in the block, see mempool.tx_size().
+        @param max_tx: Transaction limit of the block.
+        """
+        self.max_bytes = max_bytes
+        self.max_tx = max_tx
+
+    def build(self, mempool):
+        """
+        @param mempool: Mempool instance.
+        @return: BlockTemplate with the transactions in block order, their size and fees.
+        """
+        transactions = []
+        included = set()
+        # Transactions waiting for a parent, by the id of that parent.
+        waiting = {}
+        size = 0
+        fees = 0.0
+
+        for entry in mempool.by_priority():
+            if len(transactions) >= self.max_tx:
+                break
+
+            pending = deque([entry])
+
+            while pending and len(transactions) < self.max_tx:
+                entry = pending.popleft()
+
+                if entry.tx.tx_id in included or size + entry.size > self.max_bytes:
+                    continue
+
+                missing_parent = _missing_parent(entry.tx, mempool, included)
+                if missing_parent is not None:
+                    waiting.setdefault(missing_parent, []).append(entry)
+                    continue
+
+                transactions.append(entry.tx)
+                included.add(entry.tx.tx_id)
+                size += entry.size
+                fees += entry.fee
+
+                # Children keep their fee rate order among themselves.
+                pending.extend(waiting.pop(entry.tx.tx_id, []))
+
+        return BlockTemplate(transactions, size, fees)
+
+
+def _missing_parent(transaction, mempool, included):
+    for tx_input in getattr(transaction, "tx_inputs", ()):
+        if tx_input.parent_tx_id not in included and tx_input.parent_tx_id in mempool:
+            return tx_input.parent_tx_id
+    return None
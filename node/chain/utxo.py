@@ -0,0 +1,264 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from transaction.tx_output import TransactionOutput, OutPoint
+from util.cache import LRUCache
+
+# Cached marker for outputs that are known to not exist.
+_MISSING = object()
+# Rows read per query when iterating the set.
+_PAGE_SIZE = 1000
+
+
+class UtxoSet:
+
+    def __init__(self, path=":memory:", cache_size=100000):
+        """
+        Set of unspent transaction outputs stored in SQLite.
+        Outputs are keyed by (parent_tx_id, vout) and the most used ones are kept in an LRU cache.
+        Changes made inside batch() are written to the database in one transaction.
+        @param path: Database file. Only kept in RAM if ":memory:".
+        @param cache_size: Number of outputs to keep in memory.
+        """
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS utxo ("
+                         "parent_tx_id TEXT NOT NULL, "
+                         "vout INTEGER NOT NULL, "
+                         "receiver TEXT NOT NULL, "
+                         "amount REAL NOT NULL, "
+                         "PRIMARY KEY (parent_tx_id, vout)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._create_address_index()
+
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._balance_changes = {}
+        self._batch_depth = 0
+        self._batch_height = None
+        self._batch_failed = False
+
+        self.height = self._get_meta("height")
+        self._count = self._get_meta("count")
+
+    def get(self, parent_tx_id, vout):
+        """
+        @param parent_tx_id: Id of the transaction that created the output.
+        @param vout: Output index in that transaction.
+        @return: TransactionOutput or None if it's not unspent.
+        """
+        key = OutPoint(parent_tx_id, int(vout))
+
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+
+            output = self._cache.get(key)
+
+            if output is None:
+                row = self._db.execute("SELECT receiver, amount FROM utxo WHERE parent_tx_id = ? AND vout = ?",
+                                       key).fetchone()
+                output = TransactionOutput(row[0], row[1], key[0], key[1]) if row else _MISSING
+                self._cache.put(key, output)
+
+            return None if output is _MISSING else output
+
+    def outputs_for(self, receiver):
+        """
+        Unspent outputs of one address, found through the receiver index.
+        @param receiver: Hashed public key.
+        @return: List of TransactionOutput.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT amount, parent_tx_id, vout FROM utxo WHERE receiver = ?",
+                                    (receiver,)).fetchall()
+            pending = dict(self._pending)
+
+        outputs = [TransactionOutput(receiver, amount, parent_tx_id, vout)
+                   for amount, parent_tx_id, vout in rows if (parent_tx_id, vout) not in pending]
+        outputs.extend(output for output in pending.values() if output is not None and output.receiver == receiver)
+
+        return outputs
+
+    def balance(self, receiver):
+        """
+        @param receiver: Hashed public key.
+        @return: Sum of all unspent outputs of the address.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT amount FROM balance WHERE receiver = ?", (receiver,)).fetchone()
+            amount, _ = self._balance_changes.get(receiver, (0.0, 0))
+
+        return (row[0] if row else 0.0) + amount
+
+    def add(self, output):
+        with self._batch():
+            stored = self.get(output.parent_tx_id, output.vout)
+            if stored is None:
+                self._count += 1
+            else:
+                self._change_balance(stored, -1)
+            self._change_balance(output, 1)
+            self._set(output, output)
+
+    def remove(self, output):
+        """
+        Removes an output, raises KeyError if it's not unspent.
+        @param output: TransactionOutput instance.
+        """
+        if output not in self:
+            raise KeyError(output)
+        self.discard(output)
+
+    def discard(self, output):
+        with self._batch():
+            stored = self.get(output.parent_tx_id, output.vout)
+            if stored is not None:
+                self._count -= 1
+                self._change_balance(stored, -1)
+                self._set(output, None)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM utxo")
+            self._db.execute("DELETE FROM balance")
+            self._balance_changes.clear()
+            self._set_meta("height", 0)
+            self._set_meta("count", 0)
+            self._pending.clear()
+            self._cache.clear()
+            self.height = 0
+            self._count = 0
+
+    @contextmanager
+    def batch(self, height=None):
+        """
+        Groups changes, e.g. all of a block, into one database transaction.
+        Nothing is written if the batch raises.
+        @param height: Chain height that the set is at after the batch.
+        """
+        with self._batch():
+            if height is not None:
+                self._batch_height = height
+            yield self
+
+    @contextmanager
+    def _batch(self):
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_failed = True
+                raise
+            finally:
+                self._batch_depth -= 1
+
+                if self._batch_depth == 0:
+                    if self._batch_failed:
+                        self._rollback()
+                    else:
+                        self._commit()
+
+    def _change_balance(self, output, sign):
+        amount, outputs = self._balance_changes.get(output.receiver, (0.0, 0))
+        self._balance_changes[output.receiver] = (amount + sign * output.amount, outputs + sign)
+
+    def _set(self, output, value):
+        key = output.outpoint
+        self._pending[key] = value
+        self._cache.put(key, _MISSING if value is None else value)
+
+    def _commit(self):
+        added = [(key[0], key[1], output.receiver, output.amount)
+                 for key, output in self._pending.items() if output is not None]
+        removed = [key for key, output in self._pending.items() if output is None]
+
+        if self._batch_height is not None:
+            self.height = self._batch_height
+
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR REPLACE INTO utxo VALUES (?, ?, ?, ?)", added)
+        self._db.executemany("DELETE FROM utxo WHERE parent_tx_id = ? AND vout = ?", removed)
+        self._db.executemany("INSERT INTO balance VALUES (?, ?, ?) ON CONFLICT (receiver) DO UPDATE "
+                             "SET amount = amount + excluded.amount, outputs = outputs + excluded.outputs",
+                             [(receiver, amount, outputs)
+                              for receiver, (amount, outputs) in self._balance_changes.items()])
+        self._db.execute("DELETE FROM balance WHERE outputs <= 0")
+        self._set_meta("height", self.height)
+        self._set_meta("count", self._count)
+        self._db.execute("COMMIT")
+
+        self._pending.clear()
+        self._balance_changes.clear()
+        self._batch_height = None
+
+    def _rollback(self):
+        # Cached outputs may have been changed by the batch.
+        self._cache.clear()
+        self._pending.clear()
+        self._balance_changes.clear()
+        self._batch_height = None
+        self._batch_failed = False
+        self._count = self._get_meta("count")
+
+    def _create_address_index(self):
+        """
+        Index from receiver to its outputs and a running balance per receiver.
+        Built from the existing outputs if the database is older than the index.
+        """
+        exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance'").fetchone()
+
+        self._db.execute("CREATE INDEX IF NOT EXISTS utxo_receiver ON utxo (receiver)")
+
+        if not exists:
+            self._db.execute("CREATE TABLE balance ("
+                             "receiver TEXT PRIMARY KEY, "
+                             "amount REAL NOT NULL, "
+                             "outputs INTEGER NOT NULL)")
+            self._db.execute("INSERT INTO balance SELECT receiver, SUM(amount), COUNT(*) FROM utxo GROUP BY receiver")
+
+    def _get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def close(self):
+        self._db.close()
+
+    def __contains__(self, output):
+        stored = self.get(output.parent_tx_id, output.vout)
+        return stored is not None and stored == output
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        with self._lock:
+            pending = dict(self._pending)
+
+        # Read in pages so that the whole set is never loaded at once.
+        last_key = ("", -1)
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT receiver, amount, parent_tx_id, vout FROM utxo "
+                                        "WHERE (parent_tx_id, vout) > (?, ?) "
+                                        "ORDER BY parent_tx_id, vout LIMIT ?",
+                                        (*last_key, _PAGE_SIZE)).fetchall()
+            if not rows:
+                break
+
+            for receiver, amount, parent_tx_id, vout in rows:
+                if (parent_tx_id, vout) not in pending:
+                    yield TransactionOutput(receiver, amount, parent_tx_id, vout)
+
+            last_key = rows[-1][2:]
+
+        for output in pending.values():
+            if output is not None:
+                yield output
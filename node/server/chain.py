@@ -1,11 +1,75 @@
+import os
+import shutil
+
 from node.chain.blockchain import Blockchain
+from node.chain.mempool import Mempool, DEFAULT_MAX_BYTES
+from node.chain.store import BlockStore
+from node.chain.template import BlockTemplateBuilder, DEFAULT_MAX_BLOCK_BYTES, DEFAULT_MAX_BLOCK_TX
+from node.server.gossip import Gossip
+from node.server.scheduler import MiningScheduler, MiningPolicy
 from wallet.network import genesis_wallet, coinbase
 
 peers = set()
+gossip = Gossip(peers)
+
+mempool = Mempool(int(os.environ.get("NODE_MEMPOOL_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                  replace_by_fee=os.environ.get("NODE_MEMPOOL_RBF", "0") == "1")
+
+# Keep the chain on disk if the node has a data directory.
+DATA_DIR = os.environ.get("NODE_DATA_DIR")
+# A chain downloaded from a peer is kept here until it replaces ours.
+SYNC_DATA_DIR = DATA_DIR + ".sync" if DATA_DIR else None
+
+if DATA_DIR:
+    blockchain = Blockchain.from_store(BlockStore(DATA_DIR), mempool)
+else:
+    blockchain = Blockchain(mempool=mempool)
+
+if len(blockchain.chain) == 0:
+    blockchain.create_genesis_block(genesis_wallet, coinbase=coinbase)
+
+mining_scheduler = MiningScheduler(MiningPolicy.from_env(), pending=lambda: (len(mempool), mempool.total_fees))
+template_builder = BlockTemplateBuilder(max_bytes=int(os.environ.get("NODE_BLOCK_MAX_BYTES", DEFAULT_MAX_BLOCK_BYTES)),
+                                        max_tx=int(os.environ.get("NODE_BLOCK_MAX_TX", DEFAULT_MAX_BLOCK_TX)))
+
+
+def create_sync_chain():
+    """
+    Empty blockchain next to the one in use, to download the chain of a peer into.
+    @return: Blockchain instance.
+    """
+    if not DATA_DIR:
+        return Blockchain()
+
+    shutil.rmtree(SYNC_DATA_DIR, ignore_errors=True)
+    return Blockchain.from_store(BlockStore(SYNC_DATA_DIR))
 
-blockchain = Blockchain()
-blockchain.create_genesis_block(genesis_wallet, coinbase=coinbase)
 
+def adopt_sync_chain(downloaded):
+    """
+    Replaces the chain in use with a downloaded one, see create_sync_chain().
+    Has to be called with the chain lock held.
+    @param downloaded: Blockchain instance.
+    """
+    if DATA_DIR:
+        # The data directory keeps its name so a restart loads the new chain.
+        downloaded.close()
+        blockchain.close()
+        old_data_dir = DATA_DIR + ".old"
+        shutil.rmtree(old_data_dir, ignore_errors=True)
+        os.rename(DATA_DIR, old_data_dir)
+        os.rename(SYNC_DATA_DIR, DATA_DIR)
+        shutil.rmtree(old_data_dir)
+        downloaded = Blockchain.from_store(BlockStore(DATA_DIR))
 
+    blockchain.replace(downloaded)
 
 
+def discard_sync_chain(downloaded):
+    """
+    Drops a downloaded chain that failed to sync, see create_sync_chain().
+    @param downloaded: Blockchain instance.
+    """
+    if DATA_DIR:
+        downloaded.close()
+        shutil.rmtree(SYNC_DATA_DIR, ignore_errors=True)
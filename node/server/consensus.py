@@ -1,36 +1,48 @@
-import ordered_set
+import json
+import os
+import threading
+
 from cryptography.exceptions import InvalidSignature
 from flask import request, Blueprint
 from termcolor import colored
 from node.chain.block import Block
-from node.chain.blockchain import Blockchain, TXPosition
-from node.chain.header import BlockHeader
-from node.server.chain import blockchain, peers
+from node.chain.blockchain import Blockchain
+from node.chain.exceptions import BlockHashError, InvalidBlockError
+from node.chain.header import BlockHeader, SUPPORTED_HEADER_ENCODINGS
+from node.chain.miner import create_miner
+from node.server.chain import blockchain, mining_scheduler, gossip, template_builder
+from transaction.type import CoinTX, FileTransaction
+from util import wire
 from util.hash import merkle_root
-import requests
-import datetime as dt
+from util.wire import CONTENT_TYPE_BINARY
 
-from wallet.crypto import verify_transaction
+from wallet.crypto import verify_transactions, verify_file_transaction
 
 consensus_api = Blueprint("consensus_api", __name__, template_folder="server")
 new_block_received = False
 candidate_blocks = list()
+# Held while the chain is extended by the miner or by a block from a peer.
+chain_lock = threading.Lock()
+miner = create_miner(os.environ.get("NODE_MINER", "pool"))
 
 
-# TODO: Make the interval waiting into a decorator.
-def start_mine_process(second_interval=15):
+def set_miner(new_miner):
     """
-    Starts the mining process.
-    The node will try to mine a new block at certain intervals within a minute.
+    Replaces the mining engine used by this node.
+    @param new_miner: Miner instance.
     """
-    print("Starting mine process. Second interval:", second_interval)
-    current_min = dt.datetime.now().second
+    global miner
+    miner.close()
+    miner = new_miner
+
 
-    while True:
-        new_min = dt.datetime.now().second
-        if new_min % second_interval == 0 and new_min != current_min:
-            _mine()
-            current_min = new_min
+def start_mine_process():
+    """
+    Starts the mining process.
+    The node sleeps until the mining policy says that a new block should be mined.
+    """
+    print("Starting mine process. Second interval:", mining_scheduler.policy.interval)
+    mining_scheduler.run(_mine)
 
 
 def _mine():
@@ -40,119 +52,182 @@ def _mine():
     and figuring out Proof Of Work.
     """
 
+    global new_block_received
+    new_block_received = False
+
     if len(blockchain.memory_pool) == 0:
         print(colored("No transactions to mine.", "red"))
         return
 
     print("Starting to mine block:", len(blockchain.chain))
 
-    # Gather all tx ids.
-    tx_ids = [tx.tx_id for tx in blockchain.memory_pool]
+    # Highest fee rates that fit in the block, the rest waits for the next one.
+    template = template_builder.build(blockchain.memory_pool)
+    transactions = template.transactions
+    print("Block template:", len(transactions), "transactions,", template.size, "bytes")
+
+    # Nothing in the mempool fits in a block.
+    if not transactions:
+        return
 
     # Block header for our candidate block.
     header = BlockHeader(previous_block_hash=blockchain.last_block.hash,
-                         merkle_root=merkle_root(tx_ids))
+                         merkle_root=merkle_root(transactions),
+                         encoding=Blockchain.header_encoding)
+    mining_scheduler.template_ready()
 
     # Guess correct nonce in header.
-    computed_hash = header.compute_hash()
-    while not computed_hash.startswith('0' * Blockchain.difficulty):
-        header.nonce += 1
-        computed_hash = header.compute_hash()
+    # Some node already sent out a new block - abort mining process.
+    result = miner.mine(header, Blockchain.difficulty, should_abort=lambda: new_block_received)
 
-        # Some node already sent out a new block - abort mining process.
-        if new_block_received:
-            return
+    if result is None:
+        return
 
-    print("Found correct nonce:", header.nonce, " Hash:", computed_hash[0:10])
+    print("Found correct nonce:", result.nonce, " Hash:", result.hash[0:10])
+    for worker, hash_rate in result.hash_rates.items():
+        print(colored("Worker " + str(worker) + ": " + str(round(hash_rate)) + " H/s", "blue"))
 
-    # TODO: Do not include tx if something goes wrong.
-    # Update UTXO and transaction position.
-    for index, transaction in enumerate(blockchain.memory_pool):
+    with chain_lock:
 
-        # Add tx position.
-        blockchain.tx_position[transaction.tx_id] = TXPosition(len(blockchain.chain), index)
-        # Add outputs as unspent.
-        for utxo in transaction.tx_outputs:
-            blockchain.utxo.add(utxo)
-        # Remove utxo that now are spent.
-        for input_tx in transaction.tx_inputs:
-            blockchain.utxo.remove(input_tx)
-            if input_tx in blockchain.utxo_pool:
-                blockchain.utxo_pool.remove(input_tx)
+        # A block from a peer was added while mining.
+        if header.previous_block_hash != blockchain.last_block.hash:
+            return
 
-    new_block = Block(index=len(blockchain.chain),
-                      transactions=list(blockchain.memory_pool),
-                      header=header)
+        new_block = Block(index=len(blockchain.chain),
+                          transactions=transactions,
+                          header=header)
+        try:
+            blockchain.add_block(new_block)
+        except InvalidBlockError as e:
+            print(colored("Mined block is invalid: " + e.message, "red"))
 
-    new_block.hash = new_block.compute_hash()
-    blockchain.chain.append(new_block)
-    blockchain.memory_pool = ordered_set.OrderedSet()
+            # Otherwise the same transactions end up in the next template again.
+            for transaction in blockchain.invalid_transactions(transactions):
+                blockchain.memory_pool.remove_with_descendants(transaction.tx_id)
+            return
 
-    print("New block added:", len(blockchain.chain))
+        blockchain.remove_from_mempool(transactions)
 
-    block_json = new_block.serialize()
+        # Transactions that didn't fit are mined on top of the new block without waiting.
+        mining_scheduler.notify_new_tip()
 
-    for peer in peers:
-        _propagate_new_block(peer, block_json)
+    print("New block added:", len(blockchain.chain))
+
+    # Peers are told about the block and fetch it if they lack it.
+    gossip.announce("blocks", new_block.hash)
 
 
-# TODO: How to handle failed propagations?
-def _propagate_new_block(node_address, block_json):
+@consensus_api.route('/header_encodings', methods=['GET'])
+def get_header_encodings():
     """
-    Sends out the newest block to all of the nodes' peers.
-    @param node_address: IP-address of node.
-    @param block_json: Block as JSON.
-    @return: 201 - Success.
+    Header encodings this node can validate and the one it mines with.
+    @return: JSON dump.
     """
-    response = requests.post(node_address + "/add_block",
-                             headers={'Content-type': 'application/json'},
-                             json=block_json)
+    return json.dumps({"supported": list(SUPPORTED_HEADER_ENCODINGS),
+                       "mining": Blockchain.header_encoding}, indent=4)
 
-    if response.status_code == 201:
-        print(colored("Block propagation successful!", "green"))
-    else:
-        print(colored("Failed to propagate block to:" + node_address, "red"))
+
+@consensus_api.route('/mining_stats', methods=['GET'])
+def get_mining_stats():
+    """
+    Scheduler metrics and the hash rate of every mining worker.
+    @return: JSON dump.
+    """
+    stats = mining_scheduler.stats()
+    stats["hash_rates"] = miner.hash_rates
+    return json.dumps(stats, indent=4)
 
 
 @consensus_api.route('/add_block', methods=['POST'])
 def listen_for_new_block():
     """
-
+    Receives a new block from a peer, as JSON or in the binary wire format.
     @return: 201 - Success. 400 - Discarded.
     """
-    block_data = request.get_json()
+    try:
+        if request.content_type == CONTENT_TYPE_BINARY:
+            new_block = wire.decode(request.get_data(), Block.read_binary)
+        else:
+            block_data = request.get_json()
 
-    new_block = Block(block_data["index"],
-                      block_data["transactions"],
-                      block_data["header"])
+            if isinstance(block_data, str):
+                block_data = json.loads(block_data)
 
-    if not _check_block(new_block):
+            new_block = Block.from_json(block_data)
+    except BlockHashError:
         return "The block was discarded.", 400
 
-    if len(candidate_blocks) == 0:
-        candidate_blocks.append(list(new_block))
-    else:
-        # Find the right candidate chain for this block.
-        for index, block in enumerate(candidate_blocks):
-            if new_block.header.previous_block_hash == block.hash:
-                candidate_blocks[index].append(new_block)
-
-        candidate_blocks.append(list(new_block))
+    if not accept_block(new_block):
+        return "The block was discarded.", 400
 
     return "Block added to the chain.", 201
 
 
-def _check_block(block):
+def accept_block(new_block):
+    """
+    Validates a block from a peer.
+    A block that builds on the last block is added to the chain, otherwise it's kept as a candidate.
+    @param new_block: Block instance.
+    @return: True if valid, false if discarded.
+    """
+    global new_block_received
+
+    if blockchain.has_block(new_block.hash):
+        return True
+
+    if not check_block(new_block):
+        return False
+
+    with chain_lock:
+        if new_block.header.previous_block_hash == blockchain.last_block.hash \
+                and new_block.index == len(blockchain.chain):
+
+            try:
+                blockchain.add_block(new_block)
+            except InvalidBlockError as e:
+                print(colored(e.message, "red"))
+                return False
+
+            # Stop mining on the old last block.
+            new_block_received = True
+            blockchain.remove_from_mempool(new_block.transactions)
+
+            gossip.announce("blocks", new_block.hash)
+            mining_scheduler.notify_new_tip()
+            return True
+
+    # Find the right candidate chain for this block.
+    for candidate in candidate_blocks:
+        if candidate[-1].hash == new_block.header.previous_block_hash:
+            candidate.append(new_block)
+            break
+    else:
+        candidate_blocks.append([new_block])
+
+    return True
+
+
+def check_block(block):
     """
-    Validates block hash and all of the transactions before adding to the chain.
+    Validates proof of work, the merkle root and the signatures of all transactions.
+    The block hash is the header hash and was computed when the block was created.
+    The inputs are checked against the UTXO set by Blockchain.add_block, once it's known where the block goes.
     @param block: Block to add.
     @return: True if added, false if discarded.
     """
-    if block.hash != block.compute_hash():
+    if not Blockchain.is_valid_proof(block):
+        return False
+    # A block with its last transactions repeated has the same merkle root (CVE-2012-2459).
+    if len({tx.tx_id for tx in block.transactions}) != len(block.transactions):
+        return False
+    if block.header.merkle_root != merkle_root(block.transactions):
+        return False
+    try:
+        # Coin transactions in parallel, file transactions have a signature per signer.
+        verify_transactions([tx for tx in block.transactions if isinstance(tx, CoinTX)])
+        for file_tx in block.transactions:
+            if isinstance(file_tx, FileTransaction):
+                verify_file_transaction(file_tx)
+    except (InvalidSignature, ValueError):
         return False
-    for tx in block.transactions:
-        try:
-            verify_transaction(tx)
-        except InvalidSignature as e:
-            return False
     return True
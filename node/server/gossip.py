@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+
+import requests
+from termcolor import colored
+
+
+class PeerStats:
+
+    def __init__(self):
+        self.sent = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    def to_dict(self):
+        return {"sent": self.sent,
+                "failures": self.failures,
+                "average_latency": self.total_latency / self.sent if self.sent else None,
+                "last_error": self.last_error}
+
+
+class Gossip:
+
+    def __init__(self, peers, workers=2, queue_size=1000, timeout=5, inv_interval=0.2, inv_batch=1000):
+        """
+        Sends messages to peers in the background.
+        Every peer has its own bounded queue and worker threads, so a slow or unreachable
+        peer only holds up its own messages. Each worker keeps its own keep-alive session.
+        Messages are dropped when the queue of the peer is full.
+        @param peers: Set of peer addresses, read on every broadcast.
+        @param workers: Number of sending threads per peer.
+        @param queue_size: Max number of queued messages per peer.
+        @param timeout: Seconds before a request to a peer is given up.
+        @param inv_interval: Seconds between each inventory announcement.
+        @param inv_batch: Announce at once when this many items are waiting.
+        """
+        self.peers = peers
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.inv_interval = inv_interval
+        self.inv_batch = inv_batch
+        self.dropped = 0
+
+        # Called with the peer address and response when a peer answers an announcement.
+        self.on_wanted = None
+
+        self._queues = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._inventory = {"tx": {}, "blocks": {}}
+        self._inventory_ready = threading.Condition(self._lock)
+
+        threading.Thread(target=self._announce_inventory, daemon=True).start()
+
+    def announce(self, kind, item_id):
+        """
+        Adds an item to the next inventory announcement.
+        Peers answer with the items they lack, see on_wanted.
+        @param kind: "tx" or "blocks".
+        @param item_id: Transaction id or block hash.
+        """
+        with self._lock:
+            self._inventory[kind][item_id] = None
+            waiting = sum(len(items) for items in self._inventory.values())
+
+            if waiting == 1 or waiting >= self.inv_batch:
+                self._inventory_ready.notify()
+
+    def broadcast(self, path, payload, callback=None):
+        """
+        Queues a message for every known peer.
+        @param path: Endpoint path, e.g. "/new_transaction".
+        @param payload: JSON payload.
+        @param callback: Called with the peer address and response after a successful post.
+        """
+        for peer in list(self.peers):
+            self.send(peer, path, payload, callback)
+
+    def send(self, peer, path, payload, callback=None):
+        """
+        Queues a message for one peer.
+        @return: False if the queue is full and the message was dropped.
+        """
+        try:
+            self._peer_queue(peer).put_nowait((path, payload, callback))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            peer_stats = {peer: stats.to_dict() for peer, stats in self._stats.items()}
+            queued = sum(messages.qsize() for messages in self._queues.values())
+
+        return {"queued": queued,
+                "dropped": self.dropped,
+                "peers": peer_stats}
+
+    def _peer_queue(self, peer):
+        with self._lock:
+            if peer not in self._queues:
+                self._queues[peer] = queue.Queue(self.queue_size)
+                self._stats[peer] = PeerStats()
+
+                for _ in range(self.workers):
+                    threading.Thread(target=self._work, args=(peer,), daemon=True).start()
+
+            return self._queues[peer]
+
+    def _announce_inventory(self):
+        while True:
+            with self._lock:
+                while not any(self._inventory.values()):
+                    self._inventory_ready.wait()
+
+                # Let more items join the announcement unless the batch is full.
+                if sum(len(items) for items in self._inventory.values()) < self.inv_batch:
+                    self._inventory_ready.wait(self.inv_interval)
+
+                inventory = {kind: list(items) for kind, items in self._inventory.items()}
+                for items in self._inventory.values():
+                    items.clear()
+
+            self.broadcast("/inv", inventory, self.on_wanted)
+
+    def _work(self, peer):
+        # Sessions aren't thread safe, every worker has its own.
+        session = requests.Session()
+        messages = self._queues[peer]
+        stats = self._stats[peer]
+
+        while True:
+            path, payload, callback = messages.get()
+            start = time.time()
+
+            try:
+                response = session.post(peer.rstrip("/") + path,
+                                        headers={'Content-type': 'application/json'},
+                                        json=payload,
+                                        timeout=self.timeout)
+                error = None if response.ok or response.status_code == 409 else response.status_code
+            except requests.RequestException as e:
+                response, error = None, str(e)
+
+            with self._lock:
+                stats.sent += 1
+                stats.total_latency += time.time() - start
+
+                if error is not None:
+                    stats.failures += 1
+                    stats.last_error = error
+
+            if error is not None:
+                print(colored("Failed to send " + path + " to: " + peer, "red"))
+            elif callback is not None:
+                try:
+                    callback(peer, response)
+                except Exception as e:
+                    print(colored("Gossip callback failed: " + str(e), "red"))
+
+            messages.task_done()
@@ -2,19 +2,18 @@ import json
 
 import requests
 from flask import request, Blueprint
+from termcolor import colored
 
 from node.chain.block import Block
 from node.chain.blockchain import Blockchain
-from node.chain.exceptions import BlockHashError
-from node.chain.header import BlockHeader
-from node.server.chain import peers
-from transaction.tx_output import TransactionOutput
-from util.serialize import JsonSerializable
-from wallet.network import genesis_wallet
+from node.chain.exceptions import BlockHashError, SyncError, InvalidBlockError
+from node.chain.header import negotiate_encoding, HEADER_ENCODING_JSON
+from node.server.chain import peers, gossip, blockchain
+from node.server.sync import stream_json, json_list, download_chain
+from util.serialize import dumps
 
 peers_api = Blueprint("peers_api", __name__, template_folder="server")
 
-global blockchain
 
 @peers_api.route('/peers', methods=['GET'])
 def get_node_peers():
@@ -25,8 +24,21 @@ def get_node_peers():
     return json.dumps({"peers": list(peers)}, indent=4)
 
 
+@peers_api.route('/gossip_stats', methods=['GET'])
+def get_gossip_stats():
+    """
+    Queue size, dropped messages and latency and failures per peer.
+    @return: JSON dump.
+    """
+    return json.dumps(gossip.stats(), indent=4)
+
+
 @peers_api.route('/register_node', methods=['POST'])
 def register_new_peers():
+    """
+    Adds a new node to the peers.
+    @return: Chain dump, or only the peers if "send_chain" is false.
+    """
     # Address of new node in the network.
     node_address = request.get_json()["node_address"]
 
@@ -37,6 +49,10 @@ def register_new_peers():
     peers.add(node_address)
     print("New node registered:", node_address)
 
+    # Nodes that sync headers first download the blocks themselves.
+    if not request.get_json().get("send_chain", True):
+        return json.dumps({"peers": [request.host_url] + list(peers)}, indent=4)
+
     return blockchain_to_json()
 
 
@@ -80,7 +96,6 @@ def register_with_existing_node():
     @return: HTTP status code of this action.
     """
     node_address = request.get_json()["node_address"]
-    global blockchain
 
     if not node_address:
         return "Need to specify node address", 400
@@ -90,21 +105,24 @@ def register_with_existing_node():
 
     # Make a request to register with remote node and obtain information
     response = requests.post(node_address + "/register_node",
-                             data=json.dumps(data),
+                             data=json.dumps(dict(data, send_chain=False)),
                              headers=headers)
 
     # Successful - Try to create local blockchain.
     if response.status_code == 200:
 
         try:
-            chain_dump = response.json()
-            blockchain = create_chain_from_dump(chain_dump)
+            node_peers = [node for node in response.json()["peers"] if node != request.host_url]
 
-            for node in response.json()["peers"]:
-                if node != request.host_url:
-                    peers.add(node)
+            # Headers from the node, blocks from all of its peers.
+            download_chain(node_address, node_peers)
 
-        except BlockHashError:
+            peers.update(node_peers)
+
+            _negotiate_header_encoding(node_address)
+
+        except (BlockHashError, InvalidBlockError, SyncError) as e:
+            print(colored(e.message, "red"))
 
             # TODO: Make sure that node is not added to peers
             #  before successful creation of local blockchain.
@@ -120,8 +138,8 @@ def register_with_existing_node():
 
         else:
             # Local chain creation successful - notify all peers in the network.
-            for node in peers:
-                if node != request.host_url or node != node_address:
+            for node in list(peers):
+                if node != request.host_url and node != node_address:
                     response = requests.post(node + "/add_node_address",
                                              data=json.dumps(data),
                                              headers=headers)
@@ -135,28 +153,43 @@ def register_with_existing_node():
         return "Failed to create and register blockchain", response.status_code
 
 
+def _negotiate_header_encoding(node_address):
+    """
+    Mine with the newest header encoding that the remote node also supports.
+    Nodes that don't know about encodings only support JSON.
+    @param node_address: IP-address of node.
+    """
+    response = requests.get(node_address + "/header_encodings")
+
+    if response.status_code == 200:
+        Blockchain.header_encoding = negotiate_encoding(response.json()["supported"])
+    else:
+        Blockchain.header_encoding = HEADER_ENCODING_JSON
+
+    print("Header encoding:", Blockchain.header_encoding)
+
+
 @peers_api.route('/chain', methods=['GET'])
 def blockchain_to_json():
     """
-    Creates a copy of the blockchain in JSON.
+    Streams a copy of the blockchain in JSON.
     Also sends UTXO and all known peers.
-    @return: JSON dump.
+    Blocks and outputs are written one at a time, use /blocks and /headers to sync in parts.
+    @return: Chunked JSON dump.
     """
-    chain_data = []
-
-    for block in blockchain.chain:
-        chain_data.append(block.__dict__)
-
     peer_list = [request.host_url]
     peer_list.extend(list(peers))
 
-    return json.dumps({"length": str(len(chain_data)),
-                       "blocks": chain_data,
-                       "data": blockchain.data_position,
-                       "utxo": list(blockchain.utxo),
-                       "peers": peer_list},
-                      default=JsonSerializable.dumper,
-                      indent=4)
+    return stream_json(_chain_parts(len(blockchain.chain), peer_list))
+
+
+def _chain_parts(length, peer_list):
+    yield '{"length": "' + str(length) + '", "blocks": '
+    yield from json_list(blockchain.serialized_block(height) for height in range(length))
+    yield ', "data": ' + dumps(blockchain.data_position)
+    yield ', "utxo": '
+    yield from json_list(dumps(output) for output in blockchain.utxo)
+    yield ', "peers": ' + json.dumps(peer_list) + '}'
 
 
 def create_chain_from_dump(chain_dump):
@@ -166,41 +199,15 @@ def create_chain_from_dump(chain_dump):
     @return: Generated blockchain.
     """
     generated_blockchain = Blockchain()
-    generated_blockchain.create_genesis_block(genesis_wallet)
-
-    generated_blockchain.data = chain_dump["data"]
-    unspent_tx = set()
 
-    for utxo in chain_dump["utxo"]:
-        unspent_tx.add(TransactionOutput.from_json(utxo))
+    # Block hashes are checked against their headers when the blocks are loaded.
+    for block_data in chain_dump["blocks"]:
+        generated_blockchain.add_block(Block.from_json(block_data))
 
-    generated_blockchain.utxo = unspent_tx
+    generated_blockchain.data_position = chain_dump["data"]
 
-    for idx, block_data in enumerate(chain_dump["blocks"]):
-
-        if idx == 0:
-            continue
-
-        header_data = block_data["header"]
-
-        header = BlockHeader.from_json(
-            header_data["previous_block_hash"],
-            header_data["merkle_root"],
-            header_data["time_stamp"],
-            header_data["nonce"]
-        )
-
-        block = Block(index=idx,
-                      transactions=block_data["transactions"],
-                      header=header)
-        block_hash = block_data["hash"]
-        block.data = block_data["data"]
-
-        # Check that block is valid.
-        if block_hash == block.compute_hash():
-            generated_blockchain.chain.append(block)
-        else:
-            print("Block hash is not matching - ERROR")
-            raise BlockHashError()
+    if not Blockchain.check_chain_validity(generated_blockchain):
+        print("Block hash is not matching - ERROR")
+        raise BlockHashError()
 
     return generated_blockchain
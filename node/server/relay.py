@@ -0,0 +1,164 @@
+import json
+import os
+
+from flask import request, Blueprint
+from termcolor import colored
+
+from node.chain.block import Block
+from node.chain.exceptions import BlockHashError
+from node.server.chain import blockchain, gossip
+from node.server.consensus import accept_block
+from transaction.type import load_transaction
+from util.cache import LRUCache
+
+relay_api = Blueprint("relay_api", __name__, template_folder="server")
+
+# Send blocks as header and short tx ids, peers rebuild them from their mempool.
+compact_blocks = os.environ.get("NODE_COMPACT_BLOCKS", "1") == "1"
+# Hex characters of the tx id used as short id.
+SHORT_ID_LENGTH = 16
+
+# Compact blocks waiting for missing transactions, by block hash.
+_partial_blocks = LRUCache(64)
+
+
+@relay_api.route('/inv', methods=['POST'])
+def receive_inventory():
+    """
+    A peer announces transaction ids and block hashes it has.
+    The node answers with the ones it lacks and the peer then sends only those.
+    @return: JSON dump of wanted tx ids and block hashes.
+    """
+    inventory = request.get_json()
+
+    wanted_tx = [tx_id for tx_id in inventory.get("tx", []) if not blockchain.has_transaction(tx_id)]
+    wanted_blocks = [block_hash for block_hash in inventory.get("blocks", []) if not blockchain.has_block(block_hash)]
+
+    return json.dumps({"tx": wanted_tx, "blocks": wanted_blocks}), 200
+
+
+@relay_api.route('/compact_block', methods=['POST'])
+def receive_compact_block():
+    """
+    Rebuilds a block from its header and short tx ids with the transactions in the mempool.
+    @return: 201 - Block added.  202 - Indexes of the missing transactions.  400 - Discarded.
+    """
+    compact = request.get_json()
+
+    if blockchain.has_block(compact["hash"]):
+        return "Block already in chain", 409
+
+    try:
+        block = Block.from_json(dict(compact, transactions=[]))
+    except BlockHashError:
+        return "The block was discarded.", 400
+
+    mempool = _mempool_by_short_id()
+    transactions = [mempool.get(short_id) for short_id in compact["short_ids"]]
+    missing = [index for index, tx in enumerate(transactions) if tx is None]
+
+    if missing:
+        _partial_blocks.put(block.hash, (block, transactions))
+        print(colored("Compact block missing " + str(len(missing)) + " tx.", "blue"))
+        return json.dumps({"hash": block.hash, "missing": missing}), 202
+
+    return _accept_rebuilt_block(block, transactions)
+
+
+@relay_api.route('/block_transactions', methods=['POST'])
+def receive_block_transactions():
+    """
+    The transactions that were missing when a compact block was received.
+    @return: 201 - Block added.  400 - Discarded.  404 - Unknown block.
+    """
+    data = request.get_json()
+    partial = _partial_blocks.pop(data["hash"])
+
+    if partial is None:
+        return "Unknown compact block", 404
+
+    block, transactions = partial
+
+    for index, tx_json in data["transactions"].items():
+        transactions[int(index)] = load_transaction(tx_json)
+
+    if any(tx is None for tx in transactions):
+        return "Transactions still missing", 400
+
+    return _accept_rebuilt_block(block, transactions)
+
+
+def compact_block(block):
+    """
+    Header of the block and the short ids of its transactions.
+    @param block: Block instance.
+    @return: Compact block as dict.
+    """
+    return {"header": block.header.serialize(),
+            "index": block.index,
+            "hash": block.hash,
+            "data": block.data,
+            "short_ids": [tx.tx_id[:SHORT_ID_LENGTH] for tx in block.transactions]}
+
+
+def _accept_rebuilt_block(block, transactions):
+    if not accept_block(block.with_transactions(transactions)):
+        return "The block was discarded.", 400
+
+    return "Block added to the chain.", 201
+
+
+def _mempool_by_short_id():
+    mempool = {}
+
+    for tx in blockchain.memory_pool:
+        short_id = tx.tx_id[:SHORT_ID_LENGTH]
+        # Colliding short ids are fetched from the peer instead.
+        mempool[short_id] = None if short_id in mempool else tx
+
+    return mempool
+
+
+def _send_wanted(peer, response):
+    """
+    Sends a peer the items it asked for in its answer to an announcement.
+    @param peer: Address of the peer.
+    @param response: Response from /inv.
+    """
+    wanted = response.json()
+
+    for tx_id in wanted.get("tx", []):
+        tx = blockchain.get_transaction(tx_id)
+        if tx is not None:
+            gossip.send(peer, "/new_transaction", tx.serialize())
+
+    for block_hash in wanted.get("blocks", []):
+        block = blockchain.get_block(block_hash)
+        if block is None:
+            continue
+
+        if compact_blocks:
+            gossip.send(peer, "/compact_block", compact_block(block), _send_missing)
+        else:
+            gossip.send(peer, "/add_block", block.serialize())
+
+
+def _send_missing(peer, response):
+    """
+    Sends the transactions a peer couldn't find in its mempool when rebuilding a compact block.
+    @param peer: Address of the peer.
+    @param response: Response from /compact_block.
+    """
+    if response.status_code != 202:
+        return
+
+    missing = response.json()
+    block = blockchain.get_block(missing["hash"])
+
+    if block is not None:
+        gossip.send(peer, "/block_transactions",
+                    {"hash": block.hash,
+                     "transactions": {index: block.transactions[index].serialize() for index in missing["missing"]}})
+
+
+gossip.on_wanted = _send_wanted
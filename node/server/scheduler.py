@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+
+class MiningPolicy:
+
+    def __init__(self, interval=15, tx_threshold=None, fee_threshold=None, mine_on_new_tip=True):
+        """
+        Decides when the node should try to mine a new block.
+        Nothing is mined while the mempool is empty.
+        @param interval: Seconds between mining attempts when there are pending transactions.
+        @param tx_threshold: Mine at once when this many transactions are pending.
+        @param fee_threshold: Mine at once when the pending fees reach this amount.
+        @param mine_on_new_tip: Mine at once when a new block from a peer arrives.
+        """
+        self.interval = interval
+        self.tx_threshold = tx_threshold
+        self.fee_threshold = fee_threshold
+        self.mine_on_new_tip = mine_on_new_tip
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the policy from the node environment variables:
+        NODE_MINE_INTERVAL, NODE_MINE_TX_THRESHOLD, NODE_MINE_FEE_THRESHOLD and NODE_MINE_ON_NEW_TIP.
+        @return: MiningPolicy instance.
+        """
+        tx_threshold = os.environ.get("NODE_MINE_TX_THRESHOLD")
+        fee_threshold = os.environ.get("NODE_MINE_FEE_THRESHOLD")
+
+        return MiningPolicy(interval=float(os.environ.get("NODE_MINE_INTERVAL", 15)),
+                            tx_threshold=int(tx_threshold) if tx_threshold else None,
+                            fee_threshold=float(fee_threshold) if fee_threshold else None,
+                            mine_on_new_tip=os.environ.get("NODE_MINE_ON_NEW_TIP", "1") == "1")
+
+    def threshold_reached(self, tx_count, fees):
+        return (self.tx_threshold is not None and tx_count >= self.tx_threshold) or \
+               (self.fee_threshold is not None and fees >= self.fee_threshold)
+
+
+class MiningScheduler:
+
+    def __init__(self, policy, pending):
+        """
+        Runs the mining function when the policy says so and sleeps otherwise.
+        The pending transactions are counted in the mempool itself, so transactions
+        left over by a block or by an aborted attempt are mined in the next run.
+        @param policy: MiningPolicy instance.
+        @param pending: Function that returns the number of pending transactions and their fees.
+        """
+        self.policy = policy
+        self._pending = pending
+        self._condition = threading.Condition()
+        self._running = False
+
+        self._pending_since = None
+        self._new_tip = False
+        self._last_run = time.time()
+        self._run_pending_since = None
+
+        # Metrics.
+        self.idle_seconds = 0.0
+        self.runs = 0
+        self.wakeups = {"timer": 0, "threshold": 0, "new_tip": 0}
+        self.time_to_template = None
+
+    def notify_tx(self):
+        """
+        Called when a transaction has been added to the mempool.
+        """
+        with self._condition:
+            if self._pending_since is None:
+                self._pending_since = time.time()
+            self._condition.notify()
+
+    def notify_new_tip(self):
+        """
+        Called when a new block has been added to the chain.
+        """
+        with self._condition:
+            self._new_tip = True
+            self._condition.notify()
+
+    def template_ready(self):
+        """
+        Called by the mining function once the candidate block has been assembled.
+        """
+        if self._run_pending_since is not None:
+            self.time_to_template = time.time() - self._run_pending_since
+
+    def run(self, mine_function):
+        """
+        Blocks and calls mine_function every time the policy triggers.
+        @param mine_function: Function without arguments.
+        """
+        self._running = True
+
+        while self._running:
+            with self._condition:
+                reason = self._wait_for_trigger()
+
+                if reason is None:
+                    continue
+
+                self.wakeups[reason] += 1
+                self._run_pending_since = self._pending_since
+                self._pending_since = None
+                self._new_tip = False
+
+            mine_function()
+            self.runs += 1
+            self._last_run = time.time()
+
+            with self._condition:
+                # Transactions left in the mempool wait from now on.
+                if self._pending_since is None and self._pending()[0] > 0:
+                    self._pending_since = self._last_run
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def stats(self):
+        pending_tx, pending_fees = self._pending()
+
+        return {"idle_seconds": self.idle_seconds,
+                "runs": self.runs,
+                "wakeups": dict(self.wakeups),
+                "time_to_template": self.time_to_template,
+                "pending_tx": pending_tx,
+                "pending_fees": pending_fees}
+
+    def _wait_for_trigger(self):
+        """
+        Sleeps on the condition until something should be mined.
+        Must be called with the condition held.
+        @return: Reason for waking up or None if stopped.
+        """
+        while self._running:
+            pending_tx, pending_fees = self._pending()
+
+            if pending_tx > 0:
+                if self._new_tip and self.policy.mine_on_new_tip:
+                    return "new_tip"
+                if self.policy.threshold_reached(pending_tx, pending_fees):
+                    return "threshold"
+
+                timeout = self._last_run + self.policy.interval - time.time()
+                if timeout <= 0:
+                    return "timer"
+            else:
+                # Empty mempool - nothing to mine until a transaction arrives.
+                self._new_tip = False
+                timeout = None
+
+            start = time.time()
+            self._condition.wait(timeout)
+            self.idle_seconds += time.time() - start
+
+        return None
@@ -0,0 +1,455 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import requests
+from cryptography.exceptions import InvalidSignature
+from flask import request, Blueprint, Response, stream_with_context
+from termcolor import colored
+
+from node.chain.block import Block
+from node.chain.blockchain import Blockchain, GENESIS_PREVIOUS_HASH, GENESIS_AMOUNT
+from node.chain.exceptions import BlockHashError, SyncError
+from node.chain.header import BlockHeader, check_header
+from node.server.chain import blockchain, create_sync_chain, adopt_sync_chain, discard_sync_chain
+from node.server.consensus import chain_lock, check_block, accept_block
+from transaction.type import CoinTX
+from util import wire
+from util.exceptions import WireFormatError
+from util.hash import merkle_root
+from util.wire import CONTENT_TYPE_BINARY, CONTENT_TYPE_JSON
+from wallet.crypto import verify_transactions
+from wallet.network import genesis_wallet, coinbase
+
+sync_api = Blueprint("sync_api", __name__, template_folder="server")
+
+# Max number of items returned by one range request.
+MAX_BLOCKS_PER_REQUEST = 500
+MAX_HEADERS_PER_REQUEST = 2000
+# Bytes gathered before a chunk of a streamed response is sent.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Initial block download: blocks per request, parallel downloads and ranges fetched ahead of the chain.
+DOWNLOAD_RANGE_SIZE = 100
+DOWNLOAD_WORKERS = int(os.environ.get("NODE_SYNC_WORKERS", 4))
+DOWNLOAD_WINDOW = 4 * DOWNLOAD_WORKERS
+DOWNLOAD_TIMEOUT = 30
+
+# Hash of the only genesis block the node syncs to. Any valid genesis block if not set.
+GENESIS_HASH = os.environ.get("NODE_GENESIS_HASH")
+
+
+@sync_api.route('/blocks', methods=['GET'])
+def get_blocks():
+    """
+    Blocks in the height range [from, to), streamed as a JSON list.
+    Sent in the binary wire format instead if the request accepts it.
+    At most MAX_BLOCKS_PER_REQUEST blocks are returned, ask again from the last height to get more.
+    @return: 200 - JSON list of blocks.  400 - Invalid range.
+    """
+    heights = _requested_range(MAX_BLOCKS_PER_REQUEST)
+
+    if heights is None:
+        return "Invalid block range", 400
+
+    if wire.accepts_binary(request.headers.get("Accept")):
+        return Response(wire.encode(blockchain.chain[heights.start:heights.stop]), mimetype=CONTENT_TYPE_BINARY)
+
+    parts = json_list(blockchain.serialized_block(height) for height in heights)
+    return stream_json(parts)
+
+
+@sync_api.route('/locate_blocks', methods=['POST'])
+def locate_blocks():
+    """
+    Blocks after the last block of a peer's locator that is on this chain.
+    At most MAX_BLOCKS_PER_REQUEST blocks are returned, the peer asks again with a new locator to get more.
+    @return: JSON dump of the height of the first block and the blocks.
+    """
+    locator = request.get_json()["locator"]
+    heights = (blockchain.height_of(block_hash) for block_hash in locator)
+    start = next((height + 1 for height in heights if height is not None), 0)
+    end = min(len(blockchain.chain), start + MAX_BLOCKS_PER_REQUEST)
+
+    def parts():
+        yield '{"start": ' + str(start) + ', "blocks": '
+        yield from json_list(blockchain.serialized_block(height) for height in range(start, end))
+        yield '}'
+
+    return stream_json(parts())
+
+
+@sync_api.route('/catch_up', methods=['POST'])
+def catch_up_with_node():
+    """
+    Downloads the blocks this node missed, e.g. while it was down, from another node.
+    @return: 200 - Number of new blocks.  409 - The chains forked, a full sync is needed.
+    """
+    node_address = request.get_json()["node_address"]
+
+    if not node_address:
+        return "Need to specify node address", 400
+
+    try:
+        added = catch_up(node_address)
+    except (BlockHashError, SyncError) as e:
+        print(colored(e.message, "red"))
+        return e.message, 409
+
+    return json.dumps({"added": added, "length": len(blockchain.chain)}), 200
+
+
+@sync_api.route('/headers', methods=['GET'])
+def get_headers():
+    """
+    Headers of the blocks in the height range [from, to), without their transactions.
+    @return: 200 - JSON list of index, hash and header.  400 - Invalid range.
+    """
+    heights = _requested_range(MAX_HEADERS_PER_REQUEST)
+
+    if heights is None:
+        return "Invalid header range", 400
+
+    # Built from the stored header and hash, the blocks are never decoded.
+    parts = json_list('{"index": ' + str(height) +
+                      ', "hash": "' + blockchain.block_hash(height) +
+                      '", "header": ' + blockchain.serialized_header(height) + '}'
+                      for height in heights)
+    return stream_json(parts)
+
+
+def stream_json(parts):
+    """
+    Streams JSON text with chunked transfer encoding, so the whole document is never held in memory.
+    @param parts: Iterable of strings that together form one JSON document.
+    @return: Flask response.
+    """
+    return Response(stream_with_context(_chunks(parts)), mimetype="application/json")
+
+
+def json_list(items):
+    """
+    @param items: Iterable of JSON strings.
+    @return: Generator of the parts of a JSON list of the items.
+    """
+    yield "["
+    for idx, item in enumerate(items):
+        yield item if idx == 0 else "," + item
+    yield "]"
+
+
+def download_chain(node_address, peer_list):
+    """
+    Headers-first initial block download.
+    The header chain of node_address is downloaded and checked first. Block bodies are then
+    fetched in ranges from all peers in parallel, validated in the download threads and
+    added to the chain in order while later ranges are still downloading.
+    Blocks that the node already has are kept if they are on the same chain. If our chain
+    forked off and the peer's chain is longer, it is downloaded next to ours and replaces it
+    once complete.
+    The chain lock is only held while a downloaded range is added, so the node keeps
+    mining and accepting blocks during the download.
+    @param node_address: Peer that the header chain is read from.
+    @param peer_list: Peers that blocks are downloaded from.
+    @return: Number of downloaded blocks.
+    """
+    node_address = node_address.rstrip("/")
+    headers = _download_headers(node_address)
+    sources = [node_address] + [peer.rstrip("/") for peer in peer_list if peer.rstrip("/") != node_address]
+
+    if GENESIS_HASH and headers[0]["hash"] != GENESIS_HASH:
+        raise SyncError("Genesis block of " + node_address + " is not " + GENESIS_HASH)
+
+    with chain_lock:
+        start = _common_length(headers)
+        length = len(blockchain.chain)
+
+    # Every header of the peer is on our chain, the peer is behind us or has the same chain.
+    if start == len(headers):
+        return 0
+
+    forked = start < length
+
+    if forked and not _replaces_chain(len(headers), length):
+        print(colored("Chain of " + node_address + " differs from ours and is not longer - keeping ours.", "yellow"))
+        return 0
+
+    # The UTXO set can't be rolled back, a forked chain is replaced as a whole.
+    if forked:
+        print(colored("Local chain differs from " + node_address + " - resyncing.", "yellow"))
+        target = create_sync_chain()
+        start = 0
+    else:
+        target = blockchain
+
+    try:
+        _download_blocks(target, sources, headers, start)
+
+        if forked:
+            with chain_lock:
+                # Our chain may have grown during the download.
+                if not _replaces_chain(len(target.chain), len(blockchain.chain)):
+                    raise SyncError("Local chain grew past the chain of " + node_address + " - keeping ours.")
+                adopt_sync_chain(target)
+    except BaseException:
+        if forked:
+            discard_sync_chain(target)
+        raise
+
+    print(colored("Downloaded " + str(len(headers) - start) + " blocks.", "green"))
+    return len(headers) - start
+
+
+def _replaces_chain(peer_length, length):
+    # Only a longer chain replaces ours, or any chain a new node that only has its own genesis block.
+    return peer_length > length or length == 1
+
+
+def _download_blocks(target, sources, headers, start):
+    """
+    Downloads the blocks from height start on and adds them to the target chain in order.
+    @param target: Blockchain instance, the chain in use or one from create_sync_chain().
+    """
+    ranges = [(height, min(height + DOWNLOAD_RANGE_SIZE, len(headers)))
+              for height in range(start, len(headers), DOWNLOAD_RANGE_SIZE)]
+
+    with ThreadPoolExecutor(DOWNLOAD_WORKERS) as executor:
+        pending = deque()
+
+        for idx, (range_start, range_end) in enumerate(ranges):
+            pending.append(executor.submit(_download_range, sources, idx, range_start, range_end, headers))
+
+            # Keep a bounded number of ranges in memory.
+            if len(pending) >= DOWNLOAD_WINDOW:
+                _apply_blocks(target, pending.popleft().result())
+
+        while pending:
+            _apply_blocks(target, pending.popleft().result())
+
+
+def catch_up(node_address):
+    """
+    Adds the blocks that a peer has after our last block to the chain.
+    Our block locator is sent and the peer answers with the blocks after the last one we share.
+    Only works if our last block is on the peer's chain, since blocks are never removed here.
+    Nothing is added if the peer is behind us.
+    @param node_address: Peer to catch up with.
+    @return: Number of added blocks.
+    """
+    node_address = node_address.rstrip("/")
+    added = 0
+
+    while True:
+        response = requests.post(node_address + "/locate_blocks",
+                                 json={"locator": blockchain.block_locator()},
+                                 timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 200:
+            raise SyncError("Failed to download blocks from " + node_address)
+
+        try:
+            located = response.json()
+            start = located["start"]
+            blocks = [Block.from_json(block_data) for block_data in located["blocks"]]
+        except (ValueError, KeyError, TypeError) as e:
+            raise SyncError("Invalid reply from " + node_address + ": " + repr(e))
+
+        # The peer has no blocks after the last one we share, e.g. because it is behind us.
+        if not blocks:
+            break
+
+        if start != len(blockchain.chain):
+            raise SyncError("Chain of " + node_address + " forked at height " + str(start) +
+                            " - register with it to resync.")
+
+        for block in blocks:
+            # accept_block keeps blocks that don't build on our last block as candidates.
+            if not accept_block(block) or blockchain.last_block.hash != block.hash:
+                raise BlockHashError("Invalid block from " + node_address + ": " + str(block.index))
+            added += 1
+
+        if len(blocks) < MAX_BLOCKS_PER_REQUEST:
+            break
+
+    print(colored("Caught up with " + node_address + ": " + str(added) + " new blocks.", "green"))
+    return added
+
+
+def _download_headers(node_address):
+    """
+    Downloads and checks the header chain: every header points to the previous block and meets the difficulty.
+    @return: List of index, hash and header dicts.
+    """
+    headers = []
+
+    while True:
+        response = requests.get(node_address + "/headers",
+                                params={"from": len(headers)},
+                                timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 200:
+            raise SyncError("Failed to download headers from " + node_address)
+
+        page = response.json()
+        if not page:
+            break
+
+        for entry in page:
+            _check_header(entry, headers)
+            headers.append(entry)
+
+        if len(page) < MAX_HEADERS_PER_REQUEST:
+            break
+
+    if not headers:
+        raise SyncError("No headers received from " + node_address)
+
+    return headers
+
+
+def _check_header(entry, headers):
+    if entry["index"] != len(headers):
+        raise BlockHashError("Header out of order: " + str(entry["index"]))
+
+    # Genesis has no proof of work.
+    check_header(BlockHeader.from_dict(entry["header"]),
+                 entry["hash"],
+                 headers[-1]["hash"] if headers else GENESIS_PREVIOUS_HASH,
+                 Blockchain.difficulty if headers else 0)
+
+
+def _common_length(headers):
+    length = 0
+
+    for entry in headers:
+        if blockchain.height_of(entry["hash"]) != entry["index"]:
+            break
+        length += 1
+
+    return length
+
+
+def _download_range(sources, idx, start, end, headers):
+    """
+    Downloads and validates the blocks [start, end), trying the next peer when one fails.
+    @return: List of Block.
+    """
+    for attempt in range(len(sources)):
+        peer = sources[(idx + attempt) % len(sources)]
+
+        try:
+            response = requests.get(peer + "/blocks",
+                                    params={"from": start, "to": end},
+                                    headers={"Accept": CONTENT_TYPE_BINARY + ", " + CONTENT_TYPE_JSON},
+                                    timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code != 200:
+                continue
+
+            # Peers without the binary format answer in JSON.
+            if response.headers.get("Content-Type", "").startswith(CONTENT_TYPE_BINARY):
+                blocks = wire.decode(response.content, Block.read_binary)
+            else:
+                blocks = [Block.from_json(block_data) for block_data in response.json()]
+        except (requests.RequestException, ValueError, KeyError, WireFormatError, BlockHashError):
+            continue
+
+        if len(blocks) != end - start:
+            continue
+
+        # A peer that sends an invalid block is skipped, the next one may have the right blocks.
+        try:
+            for height, block in enumerate(blocks, start):
+                _check_downloaded_block(block, height, headers)
+        except BlockHashError as e:
+            print(colored(peer + ": " + e.message, "red"))
+            continue
+
+        return blocks
+
+    raise SyncError("No peer could send blocks " + str(start) + " to " + str(end))
+
+
+def _check_downloaded_block(block, height, headers):
+    if block.index != height:
+        raise BlockHashError("Block out of order: " + str(block.index))
+
+    # The header chain was checked, the block hash is the hash of the block's own header.
+    if block.hash != headers[height]["hash"]:
+        raise BlockHashError("Block does not match its header: " + str(block.index))
+
+    valid = _is_valid_genesis(block) if block.index == 0 else check_block(block)
+
+    if not valid:
+        raise BlockHashError("Invalid block: " + str(block.index))
+
+
+def _is_valid_genesis(block):
+    """
+    Genesis has no proof of work. It has to be the one signed transaction of all coins
+    from the coinbase to the genesis wallet, and the pinned genesis block if there is one.
+    """
+    if GENESIS_HASH and block.hash != GENESIS_HASH:
+        return False
+    if len(block.transactions) != 1 or not isinstance(block.transactions[0], CoinTX):
+        return False
+
+    genesis_tx = block.transactions[0]
+    if (genesis_tx.sender, genesis_tx.receiver, genesis_tx.amount) != (coinbase.pk_str, genesis_wallet.pk_str,
+                                                                       GENESIS_AMOUNT):
+        return False
+    if block.header.merkle_root != merkle_root([genesis_tx]):
+        return False
+
+    try:
+        verify_transactions(block.transactions)
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+def _apply_blocks(target, blocks):
+    """
+    Adds downloaded blocks to the target chain. Blocks are checked against the UTXO set by add_block.
+    Blocks mined or received while the range was downloading are kept if they are the downloaded ones.
+    """
+    live = target is blockchain
+
+    with chain_lock if live else nullcontext():
+        for block in blocks:
+            if block.index < len(target.chain) and target.height_of(block.hash) == block.index:
+                continue
+            if block.index != len(target.chain):
+                raise SyncError("Chain changed during the download at height " + str(block.index))
+
+            target.add_block(block)
+
+            if live:
+                target.remove_from_mempool(block.transactions)
+
+
+def _requested_range(max_items):
+    length = len(blockchain.chain)
+    start = request.args.get("from", 0, type=int)
+    end = request.args.get("to", length, type=int)
+
+    if start < 0 or end < start:
+        return None
+
+    return range(start, min(end, length, start + max_items))
+
+
+def _chunks(parts):
+    chunk = []
+    size = 0
+
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk.clear()
+            size = 0
+
+    if chunk:
+        yield "".join(chunk)
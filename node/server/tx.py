@@ -1,19 +1,17 @@
 import json
 
-import requests
 from cryptography.exceptions import InvalidSignature
 from flask import request, Blueprint
 from termcolor import colored
 
-from node.chain.blockchain import TXPosition
-from node.chain.exceptions import UtxoNotFoundError, UtxoError
-from node.server.chain import blockchain, peers
-from transaction.exceptions import NotEnoughFundsException
-from transaction.tx_output import TransactionOutput
-from transaction.type import CoinTX, FileTransaction, TransactionType
-from util.hash import apply_sha256
-from util.serialize import JsonSerializable
-from wallet.crypto import verify_transaction, verify_signature
+from node.chain.exceptions import InvalidTransactionError, MempoolFullError, MempoolConflictError
+from node.server.chain import blockchain, mining_scheduler, gossip
+from transaction.type import CoinTX, FileTransaction, load_transaction, read_transaction
+from util import wire
+from util.serialize import dumps
+from util.wire import CONTENT_TYPE_BINARY
+from wallet.crypto import verify_transaction, verify_transactions, verify_file_transaction, public_key_cache_stats, \
+    signature_cache_stats
 
 tx_api = Blueprint("tx_api", __name__, template_folder="server")
 
@@ -42,9 +40,26 @@ def get_pending_tx():
     See all the current pending transactions on the block chain.
     @return: JSON dump of the mempool.
     """
-    return json.dumps(list(blockchain.memory_pool),
-                      default=JsonSerializable.dumper,
-                      indent=4)
+    return dumps(list(blockchain.memory_pool))
+
+
+@tx_api.route('/verification_stats', methods=['GET'])
+def get_verification_stats():
+    """
+    Hit and miss counters of the signature verification caches.
+    @return: JSON dump.
+    """
+    return json.dumps({"public_keys": public_key_cache_stats(),
+                       "signatures": signature_cache_stats()}, indent=4)
+
+
+@tx_api.route('/mempool_stats', methods=['GET'])
+def get_mempool_stats():
+    """
+    Number of pending transactions, their size and the fee rate needed to get in when the mempool is full.
+    @return: JSON dump.
+    """
+    return json.dumps(blockchain.memory_pool.stats(), indent=4)
 
 
 @tx_api.route('/new_transaction', methods=['POST'])
@@ -55,9 +70,10 @@ def new_coin_transaction():
     Validated transactions end up in the mempool, otherwise it'll just be discarded.
     @return: 201 - Success  409 - Already in mempool    400 - Invalid transaction.
     """
-    tx_json = request.get_json()
-    tx_loaded = json.loads(tx_json)
-    tx = _load_tx_from_json(tx_loaded)
+    if request.content_type == CONTENT_TYPE_BINARY:
+        tx = wire.decode(request.get_data(), read_transaction)
+    else:
+        tx = _load_tx_from_json(json.loads(request.get_json()))
 
     print(colored("New tx received", "green"))
 
@@ -72,15 +88,52 @@ def new_coin_transaction():
 
         print(colored("Transaction valid - Added to mempool.", "green"))
 
-        for node in peers:
-            print(colored("Sending tx to peer:" + node, "blue"))
-            _propagate_tx(node, tx_json)
+        # Peers are told about the tx and fetch it if they lack it.
+        gossip.announce("tx", tx.tx_id)
     else:
         return "Invalid transaction", 400
 
     return utxo.serialize(), 201,
 
 
+@tx_api.route('/new_transactions', methods=['POST'])
+def new_coin_transactions():
+    """
+    Bulk version of /new_transaction.
+    All signatures are verified in parallel first, the whole batch is discarded if one is invalid.
+    Transactions already in the mempool are skipped.
+    @return: 201 - Success with the sender UTXO of every accepted transaction.  400 - Invalid signature.
+    """
+    if request.content_type == CONTENT_TYPE_BINARY:
+        transactions = wire.decode(request.get_data(), read_transaction)
+    else:
+        transactions = [_load_tx_from_json(tx_json) for tx_json in request.get_json()]
+    transactions = [tx for tx in transactions if tx not in blockchain.memory_pool]
+    coin_transactions = [tx for tx in transactions if isinstance(tx, CoinTX)]
+
+    try:
+        verify_transactions(coin_transactions)
+    except InvalidSignature:
+        print(colored("Invalid signature in batch - Transactions discarded.", "red"))
+        return "Invalid signature", 400
+
+    accepted = []
+
+    # Signatures are cached now, so processing only checks the inputs.
+    for tx in transactions:
+        utxo = _process_tx(tx)
+
+        if utxo is None or utxo is False:
+            continue
+
+        accepted.append(utxo)
+        gossip.announce("tx", tx.tx_id)
+
+    print(colored(str(len(accepted)) + " of " + str(len(transactions)) + " transactions added to mempool.", "green"))
+
+    return dumps(accepted), 201
+
+
 def _process_tx(tx):
     """
     Function to choose the correct processing method for the supported transactions.
@@ -100,31 +153,7 @@ def _load_tx_from_json(json):
     @param json: Transaction as JSON.
     @return: Transaction instance.
     """
-    if json["type"] == TransactionType.TOKEN_TX.value:
-        return CoinTX.from_json(json)
-    elif json["type"] == TransactionType.FILE_TX.value:
-        return FileTransaction.from_json(json)
-
-
-def _propagate_tx(node_address, tx_json):
-    """
-    Function to propagate valid transactions across the networks nodes.
-    Will test all current peers that the node is aware of.
-    @param node_address: IP-address of node.
-    @param tx_json: Transaction as JSON.
-    @return: 201 - Success  409 - Already in mempool.
-    """
-    response = requests.post(node_address + "/new_transaction",
-                             headers={'Content-type': 'application/json'},
-                             json=tx_json)
-
-    if response.status_code == 201:
-        print(colored("Sent!", "green"))
-        # TODO: What code to signal already in mempool?
-    elif response.status_code == 409:
-        return
-    else:
-        print(colored("Failed to send!", "red"))
+    return load_transaction(json)
 
 
 # TODO: Add a cost to these transactions that goes to the miner.
@@ -140,12 +169,16 @@ def _process_file_tx(file_tx):
         _file_tx_is_valid(file_tx)
 
         # Is valid - add to mempool.
-        blockchain.memory_pool.add(file_tx)
+        _add_to_mempool(file_tx, 0.0)
+        mining_scheduler.notify_tx()
         return True
 
     except InvalidSignature:
         print("Invalid signature - Transaction failed.")
         return False
+    except MempoolFullError:
+        print("Mempool is full - Transaction failed.")
+        return False
 
 
 def _process_token_tx(transaction):
@@ -156,85 +189,54 @@ def _process_token_tx(transaction):
     @param transaction: TokenTX instance.
     @return: True if valid, false if not.
     """
-    sender = apply_sha256(transaction.sender)
-    tx_total = 0
+    miner_amount = transaction.amount * 0.01
 
     try:
-        _coin_tx_is_valid(transaction)
-
-        # Check that all input is valid.
-        for input_tx in transaction.tx_inputs:
-
-            # Check UTXO recipient key and sender key.
-            if input_tx.receiver != sender:
-                raise UtxoError("Public key does not match")
-
-            # Check if input is unspent.
-            if input_tx not in blockchain.utxo and input_tx not in blockchain.utxo_pool:
-                raise UtxoNotFoundError
+        # Inputs already spent by a pending transaction, checked before the costly signature check.
+        blockchain.memory_pool.check_conflicts(transaction, miner_amount)
 
-            # Find location of parent TX.
-            block_idx, tx_idx = blockchain.tx_position[input_tx.parent_tx_id]
-
-            # Check if parent TX is valid.
-            if block_idx == len(blockchain.chain):
-                origin_tx = blockchain.memory_pool[tx_idx]
-                _coin_tx_is_valid(origin_tx)
-            else:
-                origin_tx = blockchain.chain[block_idx].transactions[tx_idx]
-                _coin_tx_is_valid(origin_tx)
-
-            tx_total += input_tx.amount
+        _coin_tx_is_valid(transaction)
 
-        # Check that the amount is not smaller than all inputs combined.
-        if tx_total < transaction.amount:
-            raise NotEnoughFundsException
+        # Same input checks as for the transactions of a block, inputs can also be created by a pending TX.
+        outputs = blockchain.check_transaction(transaction, blockchain.memory_pool.has_output)
 
-        # Calculate
-        left_over = tx_total - transaction.amount
-        miner_amount = transaction.amount * 0.01
-        recipient_amount = transaction.amount
-        # sender_amount = left_over - miner_amount
-        sender_amount = left_over
+        # Check if parent TXs are valid.
+        for input_tx in transaction.tx_inputs:
+            origin_tx = blockchain.get_transaction(input_tx.parent_tx_id)
+            _coin_tx_is_valid(origin_tx)
 
-        tx_pos = TXPosition(len(blockchain.chain), len(blockchain.memory_pool))
-        blockchain.tx_position[transaction.tx_id] = tx_pos
-        utxo = _add_utxo_to_tx(transaction, sender_amount, recipient_amount, miner_amount)
-        blockchain.memory_pool.add(transaction)
-        blockchain.utxo_pool.add(utxo)
+        # The change output goes back to the wallet.
+        transaction.tx_outputs = outputs
+        utxo = transaction.tx_outputs[1]
+        _add_to_mempool(transaction, miner_amount)
+        mining_scheduler.notify_tx()
 
         return utxo
 
     except InvalidSignature:
         print("Invalid signature - Transaction failed.")
         return
-    except NotEnoughFundsException:
-        print("Not enough funds in all inputs - Transaction failed.")
+    except InvalidTransactionError as e:
+        print(e.message + " - Transaction failed.")
         return
-    except UtxoNotFoundError:
-        print("UTXO of input does not exist - Transaction failed.")
+    except MempoolConflictError as e:
+        print(e.message + " - Transaction failed.")
         return
-    except UtxoError:
-        print("UTXO addresses does not match - Transaction failed.")
+    except MempoolFullError:
+        print("Mempool is full - Transaction failed.")
         return
 
 
-# TODO: Fix miner UTXO reward.
-def _add_utxo_to_tx(transaction, sender_amount, recipient_amount, miner_amount):
+def _add_to_mempool(transaction, fee):
     """
-    Creates and adds the UTXO to the transaction.
-    @param transaction: TokenTX instance.
-    @param sender_amount: Amount to send.
-    @param recipient_amount: Amount to receive.
-    @param miner_amount: Miners fee.
-    @return: UTXO for the sender.
+    Adds a valid transaction to the mempool, which may replace or evict transactions with a lower fee rate.
+    @param transaction: Transaction instance.
+    @param fee: Miners fee.
     """
-    recipient_utxo = TransactionOutput(apply_sha256(transaction.receiver), recipient_amount, transaction.tx_id, 0)
-    sender_utxo = TransactionOutput(apply_sha256(transaction.sender), sender_amount, transaction.tx_id, 1)
-    # miner_utxo = TransactionOutput(apply_sha256(self.coinbase.pk_str), miner_amount, transaction.tx_id, 2)
-    transaction.tx_outputs = [recipient_utxo, sender_utxo]
+    removed = blockchain.memory_pool.add(transaction, fee)
 
-    return TransactionOutput(apply_sha256(transaction.sender), sender_amount, transaction.tx_id, 1)
+    if removed:
+        print(colored("Replaced or evicted " + str(len(removed)) + " pending transactions.", "yellow"))
 
 
 def _coin_tx_is_valid(transaction):
@@ -250,6 +252,4 @@ def _file_tx_is_valid(file_tx):
     Validates FileTransaction.
     @param file_tx: FileTransaction instance.
     """
-    sign_data = bytes(file_tx.get_sign_data(), "utf-8")
-    for public_key_str, signature in zip(file_tx.public_keys, file_tx.signatures):
-        verify_signature(public_key_str, signature, sign_data)
+    verify_file_transaction(file_tx)
@@ -1,27 +1,79 @@
-import json
-
 from flask import request, Blueprint
 
 from node.server.chain import blockchain
-from util.hash import apply_sha256
-from util.serialize import JsonSerializable
+from util.cache import LRUCache
+from util.hash import apply_sha256, tx_hash
+from util.merkle import MerkleTree
+from util.serialize import dumps
 
 wallet_api = Blueprint("wallet_api", __name__, template_folder="server")
 
+# Trees of recently proven blocks, wallets tend to ask about the same new blocks.
+_merkle_trees = LRUCache(256)
+MAX_FILTERS_PER_REQUEST = 2000
+
 
 @wallet_api.route('/wallet_balance', methods=['GET'])
 def get_balance():
-    total = 0
+    """
+    Balance and unspent outputs of one wallet.
+    Only touches the outputs of that wallet through the address index.
+    @return: JSON dump.
+    """
     public_key = apply_sha256(request.args.get("public_key"))
-    utxo = []
-
-    # Add all UTXO
-    for tx_output in blockchain.utxo:
-        if tx_output.receiver == public_key:
-            total += tx_output.amount
-            utxo.append(tx_output)
-
-    return json.dumps({"balance": total,
-                       "utxo": utxo},
-                      default=JsonSerializable.dumper,
-                      indent=4)
+
+    return dumps({"balance": blockchain.utxo.balance(public_key),
+                  "utxo": blockchain.utxo.outputs_for(public_key)})
+
+
+@wallet_api.route('/merkle_proof', methods=['GET'])
+def get_merkle_proof():
+    """
+    Proof that a transaction is in a block, for wallets that only keep block headers.
+    The wallet checks the proof against the merkle root of a header it has verified itself.
+    @return: 200 - Block hash, height, position, proof and the transaction.  404 - Not in a block.
+    """
+    tx_id = request.args.get("tx_id")
+    position = blockchain.position_of(tx_id)
+
+    # Transactions in the mempool aren't in a block yet.
+    if position is None or position.block_idx >= len(blockchain.chain):
+        return "Transaction not in a block", 404
+
+    block = blockchain.chain[position.block_idx]
+    tree = _merkle_trees.get(block.hash)
+
+    if tree is None:
+        tree = MerkleTree([tx_hash(transaction) for transaction in block.transactions])
+        _merkle_trees.put(block.hash, tree)
+
+    return dumps({"block_hash": block.hash,
+                  "height": position.block_idx,
+                  "index": position.tx_idx,
+                  "proof": tree.proof(position.tx_idx),
+                  "transaction": block.transactions[position.tx_idx]})
+
+
+@wallet_api.route('/block_filters', methods=['GET'])
+def get_block_filters():
+    """
+    Compact filters of the blocks in the height range [from, to), see node.chain.filters.
+    Wallets match their addresses locally and only download the blocks that match,
+    so the node neither scans for them nor learns their addresses.
+    @return: 200 - JSON list of height, block hash, number of items and filter as hex.  400 - Invalid range.
+    """
+    length = len(blockchain.filters)
+    start = request.args.get("from", 0, type=int)
+    end = min(request.args.get("to", length, type=int), length, start + MAX_FILTERS_PER_REQUEST)
+
+    if start < 0:
+        return "Invalid filter range", 400
+
+    filters = []
+
+    for height in range(start, end):
+        block_hash = blockchain.block_hash(height)
+        gcs_filter = blockchain.filters.get(height, block_hash)
+        filters.append({"height": height, "hash": block_hash, "n": gcs_filter.n, "filter": gcs_filter.data.hex()})
+
+    return dumps(filters)
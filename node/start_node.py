@@ -4,6 +4,8 @@ from flask import Flask
 
 from node.server.consensus import consensus_api, start_mine_process
 from node.server.peers import peers_api
+from node.server.relay import relay_api
+from node.server.sync import sync_api
 from node.server.tx import tx_api
 from node.server.wallet import wallet_api
 
@@ -12,6 +14,8 @@ app.register_blueprint(tx_api)
 app.register_blueprint(consensus_api)
 app.register_blueprint(wallet_api)
 app.register_blueprint(peers_api)
+app.register_blueprint(relay_api)
+app.register_blueprint(sync_api)
 
 try:
     start_new_thread(start_mine_process, ())
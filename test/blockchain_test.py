@@ -0,0 +1,78 @@
+import unittest
+
+from node.chain.blockchain import Blockchain
+from node.chain.exceptions import InvalidTransactionError
+from transaction.type import CoinTX
+from wallet.private import PrivateWallet
+
+COINBASE = PrivateWallet.coinbase_wallet()
+GENESIS_WALLET = PrivateWallet.genesis_wallet()
+
+
+def _spend(inputs, amount, receiver="receiver"):
+    transaction = CoinTX(GENESIS_WALLET.pk_str, receiver, amount, inputs)
+    transaction.tx_outputs = transaction.create_outputs(sum(tx_input.amount for tx_input in inputs))
+    return transaction
+
+
+class CheckTransactionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blockchain = Blockchain()
+        self.blockchain.create_genesis_block(GENESIS_WALLET, COINBASE)
+        self.coin = self.blockchain.chain[0].transactions[0].tx_outputs[0]
+
+    def test_valid_transactions(self):
+        parent = _spend([self.coin], 10)
+        child = _spend([parent.tx_outputs[1]], 20)
+
+        self.assertEqual(self.blockchain.invalid_transactions([parent, child]), [])
+
+    def test_invalid_transaction_and_descendants(self):
+        double_spend = _spend([self.coin, self.coin], 10)
+        child = _spend([double_spend.tx_outputs[1]], 20)
+        valid = _spend([self.coin], 30)
+
+        self.assertEqual(self.blockchain.invalid_transactions([double_spend, child, valid]), [double_spend, child])
+
+    def test_output_spent_by_two_transactions(self):
+        first = _spend([self.coin], 10)
+        second = _spend([self.coin], 20)
+
+        self.assertEqual(self.blockchain.invalid_transactions([first, second]), [second])
+
+
+class CheckTransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blockchain = Blockchain()
+        self.blockchain.create_genesis_block(GENESIS_WALLET, COINBASE)
+        self.coin = self.blockchain.chain[0].transactions[0].tx_outputs[0]
+
+    def test_outputs(self):
+        transaction = _spend([self.coin], 10)
+        self.assertEqual(self.blockchain.check_transaction(transaction), transaction.tx_outputs)
+
+    def test_pending_input(self):
+        parent = _spend([self.coin], 10)
+        child = _spend([parent.tx_outputs[1]], 20)
+
+        self.assertRaises(InvalidTransactionError, self.blockchain.check_transaction, child)
+        self.assertEqual(self.blockchain.check_transaction(child, lambda output: output == parent.tx_outputs[1]),
+                         child.tx_outputs)
+
+    def test_invalid(self):
+        other = CoinTX(COINBASE.pk_str, "receiver", 10, [self.coin])
+        invalid = [_spend([self.coin, self.coin], 10),
+                   _spend([], 10),
+                   _spend([self.coin], 0),
+                   _spend([self.coin], -10),
+                   _spend([self.coin], self.coin.amount + 1),
+                   other]
+
+        for transaction in invalid:
+            self.assertRaises(InvalidTransactionError, self.blockchain.check_transaction, transaction)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from node.chain.filters import BlockFilterIndex
+from util.gcs import GCSFilter
+
+KEY = bytes(range(16))
+
+
+def _addresses(prefix, count):
+    return [hashlib.sha256((prefix + str(idx)).encode()).hexdigest() for idx in range(count)]
+
+
+class GCSFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = _addresses("in", 500)
+        self.gcs_filter = GCSFilter.build(KEY, self.items)
+
+    def test_matches_every_item(self):
+        self.assertEqual(self.gcs_filter.n, 500)
+
+        for item in self.items:
+            self.assertTrue(self.gcs_filter.match_any([item]))
+
+    def test_misses(self):
+        # False positives happen once in FILTER_M items.
+        misses = _addresses("out", 1000)
+
+        self.assertFalse(self.gcs_filter.match_any(misses))
+        self.assertTrue(self.gcs_filter.match_any(misses + self.items[-1:]))
+
+    def test_empty(self):
+        empty = GCSFilter.build(KEY, [])
+
+        self.assertEqual(empty.n, 0)
+        self.assertEqual(empty.data, b"")
+        self.assertFalse(empty.match_any(self.items))
+        self.assertFalse(self.gcs_filter.match_any([]))
+
+    def test_duplicate_items(self):
+        self.assertEqual(GCSFilter.build(KEY, self.items + self.items).data, self.gcs_filter.data)
+
+    def test_from_hex(self):
+        loaded = GCSFilter.from_hex(KEY, self.gcs_filter.n, self.gcs_filter.data.hex())
+
+        self.assertEqual(loaded.data, self.gcs_filter.data)
+        self.assertTrue(loaded.match_any(self.items[100:101]))
+
+    def test_key(self):
+        other = GCSFilter(bytes(16), self.gcs_filter.n, self.gcs_filter.data)
+        self.assertFalse(all(other.match_any([item]) for item in self.items[:20]))
+
+    def test_truncated_data(self):
+        truncated = GCSFilter(KEY, self.gcs_filter.n, self.gcs_filter.data[:10])
+        self.assertRaises(ValueError, truncated.match_any, self.items[-1:])
+
+
+class BlockFilterIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "filters.dat")
+        self.block_hashes = _addresses("block", 3)
+        self.filters = [GCSFilter.build(bytes.fromhex(block_hash)[:16], _addresses(block_hash, idx * 10))
+                        for idx, block_hash in enumerate(self.block_hashes)]
+
+        self.index = BlockFilterIndex(self.path)
+        for gcs_filter in self.filters:
+            self.index.append(gcs_filter)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def _assert_filters(self, index, count):
+        self.assertEqual(len(index), count)
+        for height in range(count):
+            gcs_filter = index.get(height, self.block_hashes[height])
+            self.assertEqual((gcs_filter.n, gcs_filter.data), (self.filters[height].n, self.filters[height].data))
+        self.assertRaises(IndexError, index.get, count, self.block_hashes[0])
+
+    def _reopen(self):
+        self.index.close()
+        self.index = BlockFilterIndex(self.path)
+
+    def test_reopen(self):
+        self._assert_filters(self.index, 3)
+        self._reopen()
+        self._assert_filters(self.index, 3)
+
+    def test_truncate(self):
+        self.index.truncate(1)
+        self._assert_filters(self.index, 1)
+
+        self.index.append(self.filters[1])
+        self._reopen()
+        self._assert_filters(self.index, 2)
+
+    def test_partial_write(self):
+        # Crash after writing part of a filter, before its index record.
+        with open(self.path, "ab") as file:
+            file.write(b"\x05\x00")
+        self._reopen()
+        self._assert_filters(self.index, 3)
+
+        self.index.append(self.filters[0])
+        self.assertEqual(self.index.get(3, self.block_hashes[0]).data, self.filters[0].data)
+
+    def test_missing_index_records(self):
+        # Crash after writing a filter, before its index record.
+        with open(os.path.join(self.directory, "filters.idx"), "r+b") as file:
+            file.truncate(file.seek(0, os.SEEK_END) - 10)
+        self._reopen()
+        self._assert_filters(self.index, 3)
+
+    def test_rebuild_lost_index(self):
+        self.index.close()
+        os.remove(os.path.join(self.directory, "filters.idx"))
+        self.index = BlockFilterIndex(self.path)
+
+        self._assert_filters(self.index, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+
+from node.chain.exceptions import MempoolConflictError, MempoolFullError
+from node.chain.mempool import Mempool, tx_size
+from transaction.tx_output import TransactionOutput
+from transaction.type import CoinTX
+from util.hash import apply_sha256
+
+SENDER = "sender public key"
+
+
+def _coin(vout, amount=100):
+    # Confirmed output of the sender.
+    return TransactionOutput(apply_sha256(SENDER), amount, "ab" * 32, vout)
+
+
+def _spend(inputs, amount, receiver="receiver"):
+    transaction = CoinTX(SENDER, receiver, amount, inputs)
+    # Same size for transactions with as many inputs.
+    transaction.time_stamp = 1700000000.0
+    transaction.tx_outputs = transaction.create_outputs(sum(tx_input.amount for tx_input in inputs))
+    return transaction
+
+
+class MempoolTest(unittest.TestCase):
+
+    def test_add(self):
+        mempool = Mempool()
+        transaction = _spend([_coin(0)], 10)
+
+        self.assertEqual(mempool.add(transaction, 1.0), [])
+        self.assertIn(transaction, mempool)
+        self.assertIn(transaction.tx_id, mempool)
+        self.assertIs(mempool.get(transaction.tx_id), transaction)
+        self.assertTrue(mempool.has_output(transaction.tx_outputs[1]))
+        self.assertFalse(mempool.has_output(_coin(1)))
+        self.assertEqual(mempool.spender(_coin(0).outpoint), transaction.tx_id)
+        self.assertEqual(mempool.from_sender(SENDER), [transaction])
+        self.assertEqual(mempool.stats()["bytes"], tx_size(transaction))
+
+        mempool.remove(transaction.tx_id)
+
+        self.assertEqual(len(mempool), 0)
+        self.assertIsNone(mempool.spender(_coin(0).outpoint))
+        self.assertEqual(mempool.from_sender(SENDER), [])
+        self.assertEqual(mempool.total_fees, 0.0)
+
+    def test_conflict_without_replace_by_fee(self):
+        mempool = Mempool()
+        first = _spend([_coin(0)], 10)
+        mempool.add(first, 1.0)
+
+        self.assertRaises(MempoolConflictError, mempool.add, _spend([_coin(0)], 20), 50.0)
+        self.assertEqual(list(mempool), [first])
+
+    def test_replace_by_fee(self):
+        mempool = Mempool(replace_by_fee=True)
+        first = _spend([_coin(0)], 10)
+        mempool.add(first, 1.0)
+
+        self.assertRaises(MempoolConflictError, mempool.add, _spend([_coin(0)], 20), 0.5)
+
+        replacement = _spend([_coin(0)], 30)
+        self.assertEqual(mempool.add(replacement, 5.0), [first])
+        self.assertEqual(list(mempool), [replacement])
+        self.assertEqual(mempool.spender(_coin(0).outpoint), replacement.tx_id)
+        self.assertEqual(mempool.total_fees, 5.0)
+
+    def test_replacement_pays_for_descendants(self):
+        mempool = Mempool(replace_by_fee=True)
+        parent = _spend([_coin(0)], 10)
+        child = _spend([parent.tx_outputs[1]], 20)
+        mempool.add(parent, 1.0)
+        mempool.add(child, 1.0)
+
+        self.assertRaises(MempoolConflictError, mempool.add, _spend([_coin(0)], 30), 1.5)
+        # Spending an output of a transaction it replaces.
+        self.assertRaises(MempoolConflictError, mempool.add, _spend([_coin(0), parent.tx_outputs[0]], 30), 10.0)
+
+        replacement = _spend([_coin(0)], 30)
+        self.assertEqual(mempool.add(replacement, 3.0), [parent, child])
+        self.assertEqual(list(mempool), [replacement])
+
+    def test_remove_with_descendants(self):
+        mempool = Mempool()
+        parent = _spend([_coin(0)], 10)
+        child = _spend([parent.tx_outputs[1]], 20)
+        grandchild = _spend([child.tx_outputs[1]], 30)
+        other = _spend([_coin(1)], 40)
+
+        for transaction in (parent, child, grandchild, other):
+            mempool.add(transaction, 1.0)
+
+        self.assertEqual(mempool.remove_with_descendants(parent.tx_id), [parent, child, grandchild])
+        self.assertEqual(list(mempool), [other])
+
+    def test_evicts_lowest_fee_rate(self):
+        transactions = [_spend([_coin(vout)], vout + 1) for vout in range(4)]
+        mempool = Mempool(max_bytes=sum(tx_size(transaction) for transaction in transactions[:3]))
+
+        for fee, transaction in zip((2.0, 1.0, 3.0), transactions):
+            mempool.add(transaction, fee)
+
+        self.assertEqual(mempool.add(transactions[3], 4.0), [transactions[1]])
+        self.assertEqual(list(mempool), [transactions[0], transactions[2], transactions[3]])
+
+        self.assertRaises(MempoolFullError, mempool.add, _spend([_coin(9)], 50), 0.5)
+        self.assertEqual(len(mempool), 3)
+
+    def test_eviction_removes_descendants(self):
+        parent = _spend([_coin(0)], 10)
+        child = _spend([parent.tx_outputs[1]], 20)
+        newest = _spend([_coin(1)], 30)
+        mempool = Mempool(max_bytes=tx_size(parent) + tx_size(child))
+
+        mempool.add(parent, 1.0)
+        mempool.add(child, 10.0)
+
+        self.assertEqual(mempool.add(newest, 5.0), [parent, child])
+        self.assertEqual(list(mempool), [newest])
+
+    def test_full_pool_keeps_replaced_transactions(self):
+        replaced = _spend([_coin(0)], 10)
+        others = [_spend([_coin(5)], 20), _spend([_coin(6)], 30)]
+        mempool = Mempool(max_bytes=tx_size(replaced) + sum(tx_size(transaction) for transaction in others),
+                          replace_by_fee=True)
+
+        mempool.add(replaced, 1.0)
+        for transaction in others:
+            mempool.add(transaction, 100.0)
+        stats = mempool.stats()
+
+        # Pays more than the transaction it replaces, but is larger and has the lowest fee rate in the pool.
+        replacement = _spend([_coin(0), _coin(1), _coin(2)], 40)
+        self.assertRaises(MempoolFullError, mempool.add, replacement, 2.0)
+
+        self.assertEqual(list(mempool), [replaced] + others)
+        self.assertEqual(mempool.spender(_coin(0).outpoint), replaced.tx_id)
+        self.assertIsNone(mempool.spender(_coin(1).outpoint))
+        self.assertEqual(mempool.stats(), stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import hashlib
+import unittest
+
+from util.merkle import MerkleTree, hash_pair
+
+
+def _leaves(count):
+    return [hashlib.sha256(str(idx).encode()).hexdigest() for idx in range(count)]
+
+
+class MerkleTreeTest(unittest.TestCase):
+
+    def test_root(self):
+        a, b, c = _leaves(3)
+        ab = hash_pair(bytes.fromhex(a), bytes.fromhex(b))
+        cc = hash_pair(bytes.fromhex(c), bytes.fromhex(c))
+
+        self.assertIsNone(MerkleTree().root)
+        self.assertEqual(MerkleTree([a]).root, a)
+        self.assertEqual(MerkleTree([a, b]).root, ab.hex())
+        # Odd levels pair the last node with itself.
+        self.assertEqual(MerkleTree([a, b, c]).root, hash_pair(ab, cc).hex())
+
+    def test_repeated_last_leaf_has_same_root(self):
+        # Why blocks with duplicate transactions are rejected (CVE-2012-2459).
+        leaves = _leaves(5)
+        self.assertEqual(MerkleTree(leaves).root, MerkleTree(leaves + leaves[-1:]).root)
+
+    def test_append_matches_batch(self):
+        leaves = _leaves(20)
+        tree = MerkleTree()
+
+        for count, leaf in enumerate(leaves, 1):
+            tree.append(leaf)
+            self.assertEqual(tree.root, MerkleTree(leaves[:count]).root)
+
+    def test_proof(self):
+        for count in range(1, 10):
+            leaves = _leaves(count)
+            tree = MerkleTree(leaves)
+
+            for index, leaf in enumerate(leaves):
+                self.assertTrue(MerkleTree.verify_proof(leaf, index, tree.proof(index), tree.root))
+
+    def test_invalid_proof(self):
+        leaves = _leaves(6)
+        tree = MerkleTree(leaves)
+        proof = tree.proof(2)
+
+        self.assertFalse(MerkleTree.verify_proof(leaves[3], 2, proof, tree.root))
+        self.assertFalse(MerkleTree.verify_proof(leaves[2], 3, proof, tree.root))
+        self.assertFalse(MerkleTree.verify_proof(leaves[2], 2, proof[:-1], tree.root))
+        self.assertRaises(IndexError, tree.proof, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from node.chain.block import Block
+from node.chain.header import BlockHeader
+from node.chain.store import BlockStore
+from transaction.type import CoinTX
+from util.hash import merkle_root
+
+
+def _create_block(index, previous_hash, tx_count, sender):
+    transactions = [CoinTX(sender, "receiver", idx + 1, []) for idx in range(tx_count)]
+    for transaction in transactions:
+        transaction.tx_outputs = []
+
+    header = BlockHeader(previous_hash, merkle_root(transactions))
+    return Block(index, transactions, header)
+
+
+class BlockStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = BlockStore(self.directory)
+        self.blocks = []
+
+        previous_hash = "0" * 64
+        for index in range(3):
+            block = _create_block(index, previous_hash, 400, "sender" + str(index))
+            self.store.append(block)
+            self.blocks.append(block)
+            previous_hash = block.hash
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        self.store.close()
+        self.store = BlockStore(self.directory)
+
+    def test_reopen(self):
+        self.reopen()
+
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store[1].hash, self.blocks[1].hash)
+        self.assertEqual(self.store.hash_at(2), self.blocks[2].hash)
+
+    def test_lookup_by_hash(self):
+        # 1200 transactions, more than fit in the initial hash index.
+        for height, block in enumerate(self.blocks):
+            self.assertEqual(self.store.height_of(block.hash), height)
+            self.assertEqual(self.store.tx_position(block.transactions[-1].tx_id), (height, 399))
+
+        self.assertIsNone(self.store.height_of("ab" * 32))
+        self.assertIsNone(self.store.height_of("not a hash"))
+        self.assertIsNone(self.store.tx_position(None))
+
+    def test_truncate(self):
+        self.store.truncate(1)
+        self.reopen()
+
+        self.assertEqual(len(self.store), 1)
+        self.assertIsNone(self.store.height_of(self.blocks[1].hash))
+        self.assertIsNone(self.store.tx_position(self.blocks[2].transactions[0].tx_id))
+        self.assertEqual(self.store.tx_position(self.blocks[0].transactions[5].tx_id), (0, 5))
+
+        # The next block reuses the truncated heights.
+        block = _create_block(1, self.blocks[0].hash, 3, "other sender")
+        self.store.append(block)
+
+        self.assertEqual(self.store.height_of(block.hash), 1)
+        self.assertEqual(self.store.tx_position(block.transactions[2].tx_id), (1, 2))
+        self.assertEqual(self.store[1].hash, block.hash)
+
+    def test_rebuild_lost_hash_index(self):
+        self.store.close()
+        os.remove(os.path.join(self.directory, "blocks.hix"))
+        os.remove(os.path.join(self.directory, "tx.hix"))
+        self.store = BlockStore(self.directory)
+
+        self.assertEqual(self.store.height_of(self.blocks[2].hash), 2)
+        self.assertEqual(self.store.tx_position(self.blocks[1].transactions[7].tx_id), (1, 7))
+
+    def test_read_header(self):
+        for height, block in enumerate(self.blocks):
+            self.assertEqual(json.loads(self.store.read_header(height)), block.header.to_dict())
+
+        self.store.truncate(2)
+        block = _create_block(2, self.blocks[1].hash, 3, "other sender")
+        self.store.append(block)
+        self.reopen()
+
+        self.assertEqual(json.loads(self.store.read_header(2)), block.header.to_dict())
+        self.assertRaises(IndexError, self.store.read_header, 3)
+
+    def test_rebuild_lost_headers(self):
+        self.store.close()
+        os.remove(os.path.join(self.directory, "headers.dat"))
+        self.store = BlockStore(self.directory)
+
+        self.assertEqual(json.loads(self.store.read_header(1)), self.blocks[1].header.to_dict())
+
+        self.store.close()
+        os.remove(os.path.join(self.directory, "headers.idx"))
+        self.store = BlockStore(self.directory)
+
+        self.assertEqual(json.loads(self.store.read_header(2)), self.blocks[2].header.to_dict())
+
+    def test_read_while_appending(self):
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                try:
+                    self.store.hash_at(-1)
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        # Switch threads often, so readers run while the index maps are replaced.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for _ in range(4)]
+
+        try:
+            for reader in readers:
+                reader.start()
+
+            previous_hash = self.blocks[-1].hash
+            for index in range(3, 200):
+                block = _create_block(index, previous_hash, 1, "sender" + str(index))
+                self.store.append(block)
+                previous_hash = block.hash
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,23 @@
-import json
+from collections import namedtuple
 
-from util.hash import apply_sha256
 from util.serialize import JsonSerializable
 
+# Reference to an output: the transaction that created it and its index in that transaction.
+OutPoint = namedtuple("OutPoint", ("parent_tx_id", "vout"))
+
 
 class TransactionOutput(JsonSerializable):
 
+    # No __dict__ per instance and the hash is computed once.
+    __slots__ = ("receiver", "amount", "parent_tx_id", "vout", "_hash")
+
     def __init__(self, receiver, amount, parent_tx_id, vout):
-        self.receiver = receiver
-        self.amount = float(amount)
-        self.parent_tx_id = parent_tx_id
-        self.vout = vout
+        set_field = super().__setattr__
+        set_field("receiver", receiver)
+        set_field("amount", float(amount))
+        set_field("parent_tx_id", parent_tx_id)
+        set_field("vout", int(vout))
+        set_field("_hash", hash((parent_tx_id, int(vout))))
 
     @classmethod
     def from_json(cls, json):
@@ -20,18 +27,46 @@ class TransactionOutput(JsonSerializable):
                                 int(json["vout"]))
         return txo
 
+    @classmethod
+    def read_binary(cls, reader):
+        return TransactionOutput(reader.read_hash(), reader.read_double(), reader.read_hash(), reader.read_uint())
+
+    def write_binary(self, writer):
+        writer.write_hash(self.receiver)
+        writer.write_double(self.amount)
+        writer.write_hash(self.parent_tx_id)
+        writer.write_uint(self.vout)
+
+    @property
+    def outpoint(self):
+        return OutPoint(self.parent_tx_id, self.vout)
+
     def serialize(self):
-        return json.loads(json.dumps({"receiver": self.receiver,
-                                      "amount": str(self.amount),
-                                      "parent_tx_id": self.parent_tx_id,
-                                      "vout": str(self.vout)
-                                      }, default=JsonSerializable.dumper, indent=4))
+        return {"receiver": self.receiver,
+                "amount": str(self.amount),
+                "parent_tx_id": self.parent_tx_id,
+                "vout": str(self.vout)}
+
+    def to_dict(self):
+        return self.serialize()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TransactionOutput is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("TransactionOutput is immutable.")
+
+    def __reduce__(self):
+        return TransactionOutput, (self.receiver, self.amount, self.parent_tx_id, self.vout)
 
     def __hash__(self):
-        return hash(apply_sha256(self.receiver, self.amount, self.parent_tx_id, self.vout))
+        return self._hash
 
     def __eq__(self, other):
-        return self.receiver == other.receiver \
-               and self.amount == other.amount \
-               and self.parent_tx_id == other.parent_tx_id \
-               and self.vout == other.vout
+        if not isinstance(other, TransactionOutput):
+            return NotImplemented
+
+        return self.parent_tx_id == other.parent_tx_id \
+               and self.vout == other.vout \
+               and self.receiver == other.receiver \
+               and self.amount == other.amount
@@ -5,6 +5,7 @@ import time
 from abc import abstractmethod
 
 from transaction.tx_output import TransactionOutput
+from util.exceptions import WireFormatError
 from util.hash import apply_sha256, file_to_hash
 from util.serialize import JsonSerializable
 
@@ -31,10 +32,11 @@ class CoinTX(JsonSerializable, Transaction):
     def __init__(self, sender_pub, receiver_pub, amount, tx_inputs):
         self.sender = sender_pub
         self.receiver = receiver_pub
-        self.amount = amount
+        self.amount = float(amount)
         self.tx_inputs = tx_inputs
+        self.tx_outputs = []
         self.time_stamp = time.time()
-        self.tx_id = apply_sha256(sender_pub, receiver_pub, amount)
+        self.tx_id = apply_sha256(sender_pub, receiver_pub, self.amount)
         self.signature = b""
 
     @classmethod
@@ -59,9 +61,43 @@ class CoinTX(JsonSerializable, Transaction):
 
         tx.time_stamp = json["time_stamp"]
         tx.signature = bytes.fromhex(json["signature"])
+        tx.tx_outputs = [TransactionOutput.from_json(tx_output) for tx_output in json.get("tx_outputs", [])]
 
         return tx
 
+    # TODO: Fix miner UTXO reward.
+    def create_outputs(self, input_total):
+        """
+        Outputs that every node derives from the inputs, they are never taken from the sender.
+        @param input_total: Sum of the inputs.
+        @return: Output with the amount for the receiver and output with the change for the sender.
+        """
+        return [TransactionOutput(apply_sha256(self.receiver), self.amount, self.tx_id, 0),
+                TransactionOutput(apply_sha256(self.sender), input_total - self.amount, self.tx_id, 1)]
+
+    @classmethod
+    def read_binary(cls, reader):
+        tx = CoinTX(reader.read_str(), reader.read_str(), reader.read_double(), [])
+        tx.time_stamp = reader.read_json()
+        tx.signature = reader.read_bytes()
+        tx.tx_inputs = [TransactionOutput.read_binary(reader) for _ in range(reader.read_uint())]
+        tx.tx_outputs = [TransactionOutput.read_binary(reader) for _ in range(reader.read_uint())]
+        return tx
+
+    def write_binary(self, writer):
+        writer.write_uint(TransactionType.TOKEN_TX.value)
+        writer.write_str(self.sender)
+        writer.write_str(self.receiver)
+        writer.write_double(self.amount)
+        # Float or hex string depending on the wallet.
+        writer.write_json(self.time_stamp)
+        writer.write_bytes(self.signature)
+
+        for outputs in (self.tx_inputs, self.tx_outputs):
+            writer.write_uint(len(outputs))
+            for output in outputs:
+                output.write_binary(writer)
+
     def get_sign_data(self):
         """
         Calculates the hash for the sender, recipient, amount and time stamp.
@@ -79,15 +115,19 @@ class CoinTX(JsonSerializable, Transaction):
         self.tx_id = self.get_sign_data()
 
     def serialize(self):
-        return json.dumps({
+        return json.dumps(self.to_dict(), indent=4)
+
+    def to_dict(self):
+        return {
             "type": 1,
             "sender": self.sender,
             "receiver": self.receiver,
             "time_stamp": self.time_stamp,
             "amount": str(self.amount),
             "signature": str(self.signature.hex()),
-            "tx_inputs": self.tx_inputs
-        }, default=JsonSerializable.dumper, indent=4)
+            "tx_inputs": [tx_input.to_dict() for tx_input in self.tx_inputs],
+            "tx_outputs": [tx_output.to_dict() for tx_output in self.tx_outputs]
+        }
 
     def __hash__(self):
         return hash(self.get_sign_data())
@@ -105,16 +145,23 @@ class FileTransaction(JsonSerializable, Transaction):
         self.signatures = []
         self.time_stamps = []
 
+    @property
+    def tx_id(self):
+        return self.get_sign_data()
+
     def get_sign_data(self):
         return apply_sha256(self.file_hash)
 
     def serialize(self):
-        return json.dumps({
+        return json.dumps(self.to_dict(), indent=4)
+
+    def to_dict(self):
+        return {
             "type": 2,
             "file_hash": self.file_hash,
             "public_keys": self.public_keys,
             "signatures": [str(signature.hex()) for signature in self.signatures]
-        }, default=JsonSerializable.dumper, indent=4)
+        }
 
     @classmethod
     def from_json(cls, json):
@@ -127,8 +174,61 @@ class FileTransaction(JsonSerializable, Transaction):
 
         return tx
 
+    @classmethod
+    def read_binary(cls, reader):
+        tx = FileTransaction(None, hash_file=False)
+
+        tx.file_hash = reader.read_hash()
+        tx.public_keys = [reader.read_str() for _ in range(reader.read_uint())]
+        tx.signatures = [reader.read_bytes() for _ in range(reader.read_uint())]
+
+        return tx
+
+    def write_binary(self, writer):
+        writer.write_uint(TransactionType.FILE_TX.value)
+        writer.write_hash(self.file_hash)
+
+        writer.write_uint(len(self.public_keys))
+        for public_key in self.public_keys:
+            writer.write_str(public_key)
+
+        writer.write_uint(len(self.signatures))
+        for signature in self.signatures:
+            writer.write_bytes(signature)
+
     def __hash__(self):
         return hash(self.get_sign_data())
 
     def __eq__(self, other):
         return self.get_sign_data() == other.get_sign_data()
+
+
+def load_transaction(tx_data):
+    """
+    Loads the right type of transaction given its transaction type value.
+    @param tx_data: Transaction as JSON string or dict.
+    @return: Transaction instance.
+    """
+    if isinstance(tx_data, str):
+        tx_data = json.loads(tx_data)
+
+    if tx_data["type"] == TransactionType.TOKEN_TX.value:
+        return CoinTX.from_json(tx_data)
+    elif tx_data["type"] == TransactionType.FILE_TX.value:
+        return FileTransaction.from_json(tx_data)
+
+
+def read_transaction(reader):
+    """
+    Binary version of load_transaction.
+    @param reader: BinaryReader positioned at a transaction.
+    @return: Transaction instance.
+    """
+    tx_type = reader.read_uint()
+
+    if tx_type == TransactionType.TOKEN_TX.value:
+        return CoinTX.read_binary(reader)
+    elif tx_type == TransactionType.FILE_TX.value:
+        return FileTransaction.read_binary(reader)
+
+    raise WireFormatError("Unknown transaction type: " + str(tx_type))
@@ -0,0 +1,5 @@
+class WireFormatError(Exception):
+
+    def __init__(self, message="Invalid binary message."):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,143 @@
+from hashlib import sha256
+
+# Golomb-Rice parameter and false positive rate 1/M, same as BIP158 basic filters.
+FILTER_P = 19
+FILTER_M = 784931
+
+
+class GCSFilter:
+
+    def __init__(self, key, n, data):
+        """
+        Golomb-coded set: a compact probabilistic set, like a Bloom filter but smaller.
+        Items are hashed to numbers in [0, N * M), sorted, and the differences between
+        them are written with Golomb-Rice coding.
+        @param key: Key the items are hashed with, e.g. the block hash.
+        @param n: Number of items.
+        @param data: Encoded differences.
+        """
+        self.key = key
+        self.n = n
+        self.data = data
+
+    @classmethod
+    def build(cls, key, items):
+        """
+        @param key: Key as bytes.
+        @param items: Items as str.
+        @return: GCSFilter instance.
+        """
+        items = set(items)
+        values = sorted(_hash_to_range(key, item, len(items) * FILTER_M) for item in items)
+
+        writer = _BitWriter()
+        last = 0
+
+        for value in values:
+            delta = value - last
+            writer.write_unary(delta >> FILTER_P)
+            writer.write_bits(delta & ((1 << FILTER_P) - 1), FILTER_P)
+            last = value
+
+        return GCSFilter(key, len(items), writer.to_bytes())
+
+    @classmethod
+    def from_hex(cls, key, n, data):
+        return GCSFilter(key, n, bytes.fromhex(data))
+
+    def match_any(self, items):
+        """
+        @param items: Items as str.
+        @return: True if any item may be in the set. False positives happen once in M items.
+        """
+        if self.n == 0:
+            return False
+
+        targets = sorted(_hash_to_range(self.key, item, self.n * FILTER_M) for item in set(items))
+        if not targets:
+            return False
+
+        reader = _BitReader(self.data)
+        value = 0
+        target_idx = 0
+
+        # Both lists are sorted, walk them side by side.
+        for _ in range(self.n):
+            value += (reader.read_unary() << FILTER_P) + reader.read_bits(FILTER_P)
+
+            while targets[target_idx] < value:
+                target_idx += 1
+                if target_idx == len(targets):
+                    return False
+
+            if targets[target_idx] == value:
+                return True
+
+        return False
+
+
+def _hash_to_range(key, item, size):
+    # BIP158 uses SipHash, SHA-256 is what this project already hashes with.
+    value = int.from_bytes(sha256(key + item.encode()).digest()[:8], "little")
+    return (value * size) >> 64
+
+
+class _BitWriter:
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._bits = 0
+        self._count = 0
+
+    def write_bits(self, value, count):
+        self._bits = (self._bits << count) | value
+        self._count += count
+
+        # Only full bytes leave the accumulator, so it stays small.
+        while self._count >= 8:
+            self._count -= 8
+            self._buffer.append((self._bits >> self._count) & 0xff)
+        self._bits &= (1 << self._count) - 1
+
+    def write_unary(self, count):
+        while count >= 8:
+            self.write_bits(0xff, 8)
+            count -= 8
+        self.write_bits((1 << count) - 1 << 1, count + 1)
+
+    def to_bytes(self):
+        if self._count:
+            return bytes(self._buffer) + bytes([(self._bits << (8 - self._count)) & 0xff])
+        return bytes(self._buffer)
+
+
+class _BitReader:
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read_bits(self, count):
+        start = self._position
+        end = start + count
+        if end > len(self._data) * 8:
+            raise ValueError("Filter ended unexpectedly.")
+
+        # Bytes that hold the bits, then drop the bits before and after.
+        window = int.from_bytes(self._data[start // 8:(end + 7) // 8], "big")
+        self._position = end
+        return (window >> (-end % 8)) & ((1 << count) - 1)
+
+    def read_unary(self):
+        count = 0
+        while self._read_bit():
+            count += 1
+        return count
+
+    def _read_bit(self):
+        byte, bit = divmod(self._position, 8)
+        if byte >= len(self._data):
+            raise ValueError("Filter ended unexpectedly.")
+
+        self._position += 1
+        return (self._data[byte] >> (7 - bit)) & 1
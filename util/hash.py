@@ -2,6 +2,9 @@ import hashlib
 
 from cryptography.hazmat.primitives.serialization import PublicFormat, Encoding
 
+from util.merkle import MerkleTree
+from util.wire import BinaryWriter
+
 
 def file_to_hash(pdf_file):
     """
@@ -40,34 +43,21 @@ def apply_sha256(*strings):
     return hashlib.sha256(concat_string.encode('utf-8')).hexdigest()
 
 
-def hash_two(line_1, line_2):
+def tx_hash(transaction):
     """
-
-    @param line_1:
-    @param line_2:
-    @return:
+    Hash of the whole transaction in the binary wire format, signature, inputs and outputs included.
+    The tx id only covers sender, receiver and amount, so blocks commit to these hashes instead.
+    @param transaction: Transaction instance.
+    @return: SHA-256 hash as hex.
     """
-    line_1 += line_2
-    first = apply_sha256(line_1)
-    last = apply_sha256(first)
-    return last
+    writer = BinaryWriter()
+    transaction.write_binary(writer)
+    return hashlib.sha256(writer.to_bytes()).hexdigest()
 
 
-def merkle_root(tx_ids):
+def merkle_root(transactions):
     """
-
-    @param tx_ids:
-    @return:
+    @param transactions: Transactions of a block.
+    @return: Merkle root over their tx hashes as hex, see MerkleTree.
     """
-    if len(tx_ids) == 1:
-        return tx_ids[0]
-    result = []
-
-    # Process pairs. For odd length, the last is skipped
-    for i in range(0, len(tx_ids) - 1, 2):
-        result.append(hash_two(tx_ids[i], tx_ids[i + 1]))
-
-    if len(tx_ids) % 2 == 1:  # odd, hash last item twice
-        result.append(hash_two(tx_ids[-1], tx_ids[-1]))
-
-    return merkle_root(result)
+    return MerkleTree([tx_hash(transaction) for transaction in transactions]).root
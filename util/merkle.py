@@ -0,0 +1,115 @@
+from hashlib import sha256
+
+HASH_SIZE = 32
+
+
+def hash_pair(left, right):
+    """
+    Double SHA-256 of two concatenated nodes.
+    @param left: 32 bytes.
+    @param right: 32 bytes.
+    @return: 32 bytes.
+    """
+    return sha256(sha256(left + right).digest()).digest()
+
+
+class MerkleTree:
+
+    def __init__(self, leaves=()):
+        """
+        Merkle tree over transaction hashes, see util.hash.tx_hash().
+        Every level is kept as one bytearray of 32 byte nodes, leaves first. A level with an
+        odd number of nodes pairs its last node with itself, so repeating the last leaves of a
+        block gives the same root and blocks have to reject duplicate transactions. Appending a
+        leaf only recomputes the last node of every level above it.
+        @param leaves: Transaction hashes as hex.
+        """
+        self._levels = [bytearray(b"".join(bytes.fromhex(leaf) for leaf in leaves))]
+
+        # Built level by level, appending one by one would hash the last nodes again for every leaf.
+        while self._level_size(len(self._levels) - 1) > 1:
+            level = len(self._levels) - 1
+            self._levels.append(bytearray(b"".join(hash_pair(self._node(level, index), self._node(level, index + 1))
+                                                   for index in range(0, self._level_size(level), 2))))
+
+    def append(self, leaf):
+        """
+        Adds a leaf and updates the nodes above it.
+        @param leaf: Transaction hash as hex.
+        """
+        self._levels[0] += bytes.fromhex(leaf)
+        index = len(self) - 1
+        level = 0
+
+        while self._level_size(level) > 1:
+            parent = index // 2
+            node = hash_pair(self._node(level, parent * 2), self._node(level, parent * 2 + 1))
+
+            if level + 1 == len(self._levels):
+                self._levels.append(bytearray())
+
+            parent_level = self._levels[level + 1]
+            parent_level[parent * HASH_SIZE:(parent + 1) * HASH_SIZE] = node
+
+            index = parent
+            level += 1
+
+    def extend(self, leaves):
+        for leaf in leaves:
+            self.append(leaf)
+
+    @property
+    def root(self):
+        """
+        @return: Merkle root as hex, None if the tree is empty.
+        """
+        if len(self) == 0:
+            return None
+        return bytes(self._levels[-1][:HASH_SIZE]).hex()
+
+    def proof(self, index):
+        """
+        Inclusion proof of a leaf: the sibling of every node on the path to the root.
+        @param index: Position of the transaction in the block.
+        @return: List of sibling hashes as hex, bottom up.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("Leaf index out of range: " + str(index))
+
+        siblings = []
+
+        for level in range(len(self._levels) - 1):
+            siblings.append(self._node(level, index ^ 1).hex())
+            index //= 2
+
+        return siblings
+
+    @staticmethod
+    def verify_proof(leaf, index, proof, root):
+        """
+        Checks that a transaction is in the tree with the given root, without the rest of the tree.
+        @param leaf: Transaction hash as hex.
+        @param index: Position of the transaction in the block.
+        @param proof: Sibling hashes from proof().
+        @param root: Merkle root as hex.
+        @return: True if the transaction is included.
+        """
+        node = bytes.fromhex(leaf)
+
+        for sibling in proof:
+            sibling = bytes.fromhex(sibling)
+            node = hash_pair(sibling, node) if index % 2 else hash_pair(node, sibling)
+            index //= 2
+
+        return index == 0 and node.hex() == root
+
+    def _node(self, level, index):
+        # Missing right node of an odd level: pair the last node with itself.
+        index = min(index, self._level_size(level) - 1)
+        return bytes(self._levels[level][index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def _level_size(self, level):
+        return len(self._levels[level]) // HASH_SIZE
+
+    def __len__(self):
+        return self._level_size(0)
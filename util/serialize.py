@@ -1,17 +1,66 @@
 import json
 
+# orjson is used for dumps() and loads() when it's installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class JsonSerializable(object):
 
+    # Lets subclasses use __slots__.
+    __slots__ = ()
+
     def serialize(self):
         return json.dumps(self.__dict__, indent=4)
 
+    def to_dict(self):
+        """
+        Plain JSON types only, nested objects included, so it's encoded in one pass by dumps().
+        """
+        return dict(self.__dict__)
+
     def __repr__(self):
         return self.serialize()
 
     @staticmethod
     def dumper(obj):
-        if "serialize" in dir(obj):
-            return obj.serialize()
+        serialize = getattr(obj, "serialize", None)
+
+        if serialize is not None:
+            return serialize()
+
+        return obj.__dict__
+
+
+def _to_dict(obj):
+    to_dict = getattr(obj, "to_dict", None)
+
+    if to_dict is None:
+        raise TypeError("Object of type " + type(obj).__name__ + " is not JSON serializable")
+
+    return to_dict()
+
+
+def dumps(obj):
+    """
+    Compact single pass JSON encoding. Objects are encoded through their to_dict().
+    @param obj: JSON types or objects with to_dict().
+    @return: JSON string.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_to_dict).decode()
+
+    return json.dumps(obj, default=_to_dict, separators=(",", ":"))
+
+
+def loads(data):
+    """
+    @param data: JSON as str or bytes.
+    @return: Decoded JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
 
-        return obj.__dict__
\ No newline at end of file
+    return json.loads(data)
@@ -0,0 +1,156 @@
+import json
+import struct
+
+from util.exceptions import WireFormatError
+
+# Content type of the binary encoding, JSON stays the default.
+CONTENT_TYPE_BINARY = "application/x-chain-binary"
+CONTENT_TYPE_JSON = "application/json"
+
+# Written first in every message, bumped when the layout changes.
+WIRE_VERSION = 2
+
+_DOUBLE = struct.Struct("<d")
+
+
+class BinaryWriter:
+
+    def __init__(self):
+        """
+        Compact binary encoding: unsigned integers as varints and every
+        variable size field prefixed with its length.
+        """
+        self._buffer = bytearray()
+
+    def write_uint(self, value):
+        while value > 0x7f:
+            self._buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self._buffer.append(value)
+
+    def write_bool(self, value):
+        self._buffer.append(1 if value else 0)
+
+    def write_double(self, value):
+        self._buffer += _DOUBLE.pack(value)
+
+    def write_bytes(self, value):
+        self.write_uint(len(value))
+        self._buffer += value
+
+    def write_str(self, value):
+        self.write_bytes(value.encode())
+
+    def write_hash(self, hex_hash):
+        """
+        @param hex_hash: SHA-256 hash as hex, written as its 32 raw bytes.
+        """
+        self._buffer += bytes.fromhex(hex_hash)
+
+    def write_json(self, value):
+        """
+        For small values without a fixed type, e.g. block data.
+        """
+        self.write_str(json.dumps(value))
+
+    def to_bytes(self):
+        return bytes(self._buffer)
+
+
+class BinaryReader:
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._offset = 0
+
+    def read_uint(self):
+        value = 0
+        shift = 0
+
+        while True:
+            byte = self._take(1)[0]
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def read_bool(self):
+        return self._take(1)[0] != 0
+
+    def read_double(self):
+        return _DOUBLE.unpack(self._take(_DOUBLE.size))[0]
+
+    def read_bytes(self):
+        return bytes(self._take(self.read_uint()))
+
+    def read_str(self):
+        return self.read_bytes().decode()
+
+    def read_hash(self):
+        return self._take(32).hex()
+
+    def read_json(self):
+        return json.loads(self.read_str())
+
+    @property
+    def at_end(self):
+        return self._offset == len(self._data)
+
+    def _take(self, size):
+        if self._offset + size > len(self._data):
+            raise WireFormatError("Message ended unexpectedly.")
+
+        chunk = self._data[self._offset:self._offset + size]
+        self._offset += size
+        return chunk
+
+
+def encode(obj):
+    """
+    @param obj: Object with write_binary(writer), or a list of such objects.
+    @return: Versioned binary message.
+    """
+    writer = BinaryWriter()
+    writer.write_uint(WIRE_VERSION)
+
+    if isinstance(obj, list):
+        writer.write_bool(True)
+        writer.write_uint(len(obj))
+        for item in obj:
+            item.write_binary(writer)
+    else:
+        writer.write_bool(False)
+        obj.write_binary(writer)
+
+    return writer.to_bytes()
+
+
+def decode(data, read):
+    """
+    @param data: Message created by encode().
+    @param read: Function that reads one object from a BinaryReader, e.g. Block.read_binary.
+    @return: The object, or a list if a list was encoded.
+    """
+    reader = BinaryReader(data)
+    version = reader.read_uint()
+
+    if version != WIRE_VERSION:
+        raise WireFormatError("Unsupported wire version: " + str(version))
+
+    if reader.read_bool():
+        result = [read(reader) for _ in range(reader.read_uint())]
+    else:
+        result = read(reader)
+
+    if not reader.at_end:
+        raise WireFormatError("Trailing bytes after message.")
+
+    return result
+
+
+def accepts_binary(accept_header):
+    """
+    @param accept_header: Value of the Accept header of a request.
+    @return: True if the binary encoding should be sent.
+    """
+    return accept_header is not None and CONTENT_TYPE_BINARY in accept_header
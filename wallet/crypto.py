@@ -1,4 +1,6 @@
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
@@ -6,9 +8,18 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
+from util.cache import LRUCache
+
 SIGN_ALGO = ec.ECDSA(hashes.SHA256())
 _curve = ec.SECP384R1()
 
+# Parsed public keys by PEM string.
+_public_keys = LRUCache(4096)
+# Transactions with a valid signature by (tx_id, signature).
+_verified_signatures = LRUCache(100000)
+# Thread pool for batch verification, cryptography releases the GIL while verifying.
+_verify_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="verify")
+
 
 class KeyPair:
 
@@ -95,18 +106,81 @@ def verify_signature(public_key_str, signature, sign_data):
     @param signature: Signature (bytes)
     @param sign_data: Data that was signed (bytes)
     """
-    public_key = serialization.load_pem_public_key(public_key_str.encode())
+    public_key = load_public_key(public_key_str)
     public_key.verify(signature, sign_data, SIGN_ALGO)
 
 
+def verify_file_transaction(file_tx):
+    """
+    Verifies every signature of a file transaction.
+    @param file_tx: FileTransaction instance.
+    """
+    sign_data = bytes(file_tx.get_sign_data(), "utf-8")
+    for public_key_str, signature in zip(file_tx.public_keys, file_tx.signatures):
+        verify_signature(public_key_str, signature, sign_data)
+
+
 # TODO: Merge this with the method above.
 def verify_transaction(transaction):
     """
     Verifies a transaction.
+    A transaction is only verified once, later calls are answered from the cache.
     @param transaction: Transaction instance.
     """
-    public_key = serialization.load_pem_public_key(transaction.sender.encode())
+    key = (transaction.tx_id, transaction.signature)
+
+    if _verified_signatures.get(key):
+        return
+
+    public_key = load_public_key(transaction.sender)
     public_key.verify(transaction.signature, bytes(transaction.get_sign_data(), "utf-8"), SIGN_ALGO)
+    _verified_signatures.put(key, True)
+
+
+def verify_transactions(transactions):
+    """
+    Verifies many transactions in parallel.
+    Raises InvalidSignature as soon as one of them is invalid, the ones not started yet are cancelled.
+    @param transactions: List of transaction instances.
+    """
+    futures = [_verify_executor.submit(verify_transaction, transaction) for transaction in transactions]
+
+    try:
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def load_public_key(public_key_str):
+    """
+    Loads a PEM public key.
+    The same senders show up over and over, so parsed keys are cached.
+    @param public_key_str: Public key as PEM string.
+    @return: Public key instance.
+    """
+    public_key = _public_keys.get(public_key_str)
+
+    if public_key is None:
+        public_key = serialization.load_pem_public_key(public_key_str.encode())
+        _public_keys.put(public_key_str, public_key)
+
+    return public_key
+
+
+def public_key_cache_stats():
+    """
+    @return: Size, capacity, hits and misses of the public key cache.
+    """
+    return _public_keys.stats()
+
+
+def signature_cache_stats():
+    """
+    @return: Size, capacity, hits and misses of the verified signature cache.
+    """
+    return _verified_signatures.stats()
 
 
 def _generate_private_number(word_list):
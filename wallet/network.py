@@ -1,11 +1,17 @@
 import json
 
 import requests
+from cryptography.exceptions import InvalidSignature
 from termcolor import colored
 
+from node.chain.block import Block
+from node.chain.exceptions import BlockHashError
+from node.chain.filters import filter_key
 from transaction.exceptions import NotEnoughFundsException
 from transaction.tx_output import TransactionOutput
-from transaction.type import FileTransaction
+from transaction.type import FileTransaction, load_transaction
+from util.gcs import GCSFilter
+from util.hash import apply_sha256, merkle_root
 from wallet.crypto import verify_transaction
 from wallet.private import PrivateWallet
 
@@ -16,12 +22,15 @@ coinbase = PrivateWallet.coinbase_wallet()
 genesis_wallet = PrivateWallet.genesis_wallet()
 
 
-# TODO: Implement SPV-wallet.
 def update_balance(wallet, public_key):
     """
-
-    @return:
+    Reads the unspent outputs of the wallet from the node.
+    SPV wallets only keep the outputs that they can verify themselves, see update_balance_spv.
+    @return: Balance.
     """
+    if wallet.spv:
+        return update_balance_spv(wallet, public_key)
+
     try:
         payload = {"public_key": public_key}
         response = requests.get(_blockchain_address + "/wallet_balance",
@@ -39,6 +48,149 @@ def update_balance(wallet, public_key):
         raise ConnectionError("Failed to connect with blockchain.")
 
 
+def sync_headers(header_chain):
+    """
+    Downloads and checks the block headers that the wallet doesn't have yet.
+    @param header_chain: HeaderChain of the wallet.
+    @return: Number of new headers.
+    """
+    start = header_chain.height
+
+    while True:
+        response = requests.get(_blockchain_address + "headers", params={"from": header_chain.height})
+        headers = response.json()
+
+        for entry in headers:
+            header_chain.add(entry)
+
+        if not headers:
+            return header_chain.height - start
+
+
+def update_balance_spv(wallet, public_key):
+    """
+    Balance of a light wallet. The node only points out the outputs, every output is
+    checked with a merkle proof against the wallet's own block headers and with the
+    signature of the transaction that created it.
+    @return: Balance of the verified outputs.
+    """
+    try:
+        sync_headers(wallet.header_chain)
+
+        response = requests.get(_blockchain_address + "wallet_balance",
+                                params={"public_key": public_key})
+        outputs = [TransactionOutput.from_json(utxo) for utxo in json.loads(response.content)["utxo"]]
+
+        proofs = {}
+        wallet.utxo = []
+
+        for output in outputs:
+
+            if output.parent_tx_id not in proofs:
+                response = requests.get(_blockchain_address + "merkle_proof",
+                                        params={"tx_id": output.parent_tx_id})
+                proofs[output.parent_tx_id] = response.json() if response.status_code == 200 else None
+
+            if _verify_output(wallet, output, proofs[output.parent_tx_id]):
+                wallet.utxo.append(output)
+            else:
+                print(colored("Could not verify output " + output.parent_tx_id[:10] + ".", "red"))
+
+        return wallet.get_balance()
+
+    except OSError:
+        raise ConnectionError("Failed to connect with blockchain.")
+
+
+def _verify_output(wallet, output, merkle_proof):
+    # Not in a block yet.
+    if merkle_proof is None:
+        return False
+
+    tx = load_transaction(merkle_proof["transaction"])
+
+    if tx.tx_id != output.parent_tx_id or not wallet.header_chain.verify_inclusion(tx, merkle_proof):
+        return False
+
+    try:
+        verify_transaction(tx)
+    except InvalidSignature:
+        return False
+
+    # The proof covers the outputs, they also have to be the ones derived from the transaction.
+    if output not in tx.tx_outputs:
+        return False
+    if output.vout == 0:
+        return output.receiver == apply_sha256(tx.receiver) and output.amount == tx.amount
+    return output.receiver == apply_sha256(tx.sender) and \
+        output.amount == sum(tx_input.amount for tx_input in tx.tx_inputs) - tx.amount
+
+
+def rescan(wallet, public_key):
+    """
+    Finds all unspent outputs of the wallet through compact block filters.
+    Filters are matched locally and only the blocks that match are downloaded,
+    so the node never gets the address. SPV wallets also check every block
+    against their own headers.
+    @return: Balance.
+    """
+    address = apply_sha256(public_key)
+    outputs = {}
+    height = 0
+
+    try:
+        if wallet.spv:
+            sync_headers(wallet.header_chain)
+
+        while True:
+            response = requests.get(_blockchain_address + "block_filters", params={"from": height})
+            filters = response.json()
+
+            if not filters:
+                break
+
+            for entry in filters:
+                gcs_filter = GCSFilter.from_hex(filter_key(entry["hash"]), entry["n"], entry["filter"])
+
+                if gcs_filter.match_any([address]):
+                    _scan_block(_download_block(wallet, entry["height"], entry["hash"]), address, outputs)
+
+            height = filters[-1]["height"] + 1
+
+    except OSError:
+        raise ConnectionError("Failed to connect with blockchain.")
+
+    wallet.utxo = list(outputs.values())
+    return wallet.get_balance()
+
+
+def _download_block(wallet, height, block_hash):
+    response = requests.get(_blockchain_address + "blocks", params={"from": height, "to": height + 1})
+    # The hash is checked against the header when the block is loaded.
+    block = Block.from_json(response.json()[0])
+
+    if block.hash != block_hash:
+        raise BlockHashError("Node sent another block than its filter: " + str(height))
+
+    if wallet.spv:
+        if height >= wallet.header_chain.height or wallet.header_chain.hashes[height] != block.hash:
+            raise BlockHashError("Block is not in the header chain: " + str(height))
+        if block.header.merkle_root != merkle_root(block.transactions):
+            raise BlockHashError("Transactions do not match the merkle root: " + str(height))
+
+    return block
+
+
+def _scan_block(block, address, outputs):
+    for transaction in block.transactions:
+        for tx_input in getattr(transaction, "tx_inputs", ()):
+            outputs.pop(tx_input.outpoint, None)
+
+        for output in getattr(transaction, "tx_outputs", ()):
+            if output.receiver == address:
+                outputs[output.outpoint] = output
+
+
 def send_transaction(wallet, receiver, amount):
     """
     Send transaction out to the network.
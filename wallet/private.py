@@ -4,11 +4,15 @@ from transaction.exceptions import NotEnoughFundsException
 from transaction.type import CoinTX
 from util.hash import public_key_to_string, apply_sha256
 from wallet.crypto import KeyPair, random_bip_word_sequence, _bip39wordlist, verify_transaction
+from wallet.spv import HeaderChain
 
 
 class PrivateWallet:
 
-    def __init__(self, word_list=None, key_file=None, key_pair=None):
+    def __init__(self, word_list=None, key_file=None, key_pair=None, spv=False):
+        """
+        @param spv: Only keep block headers and verify own transactions with merkle proofs.
+        """
 
         if word_list:
             self.key_pair = KeyPair.from_seed_phrase(word_list)
@@ -19,19 +23,25 @@ class PrivateWallet:
 
         self.utxo = []
         self.pk_str = public_key_to_string(self.key_pair.public_key)
+        self.header_chain = HeaderChain() if spv else None
 
     @property
     def public_key(self):
         return self.key_pair.public_key
 
+    @property
+    def spv(self):
+        return self.header_chain is not None
+
     @classmethod
-    def from_file(cls, key_file):
+    def from_file(cls, key_file, spv=False):
         """
         Initialize the wallet with a private key file.
         :param key_file: Path to key file.
+        :param spv: Run as light client.
         :return: PrivateWallet instance.
         """
-        return PrivateWallet(key_file=key_file)
+        return PrivateWallet(key_file=key_file, spv=spv)
 
     @classmethod
     def from_seed_phrase(cls, words):
@@ -0,0 +1,57 @@
+from node.chain.blockchain import Blockchain, GENESIS_PREVIOUS_HASH
+from node.chain.exceptions import BlockHashError
+from node.chain.header import BlockHeader, check_header
+from util.hash import tx_hash
+from util.merkle import MerkleTree
+
+
+class HeaderChain:
+
+    def __init__(self):
+        """
+        Block headers only, for wallets that don't keep the chain (SPV).
+        Every header is checked against the one before it, so the merkle roots
+        can be trusted to verify that transactions are in the chain.
+        """
+        self.hashes = []
+        self._headers = {}
+
+    def add(self, entry):
+        """
+        @param entry: Index, hash and header of a block as served by /headers.
+        """
+        if entry["index"] != len(self.hashes):
+            raise BlockHashError("Header out of order: " + str(entry["index"]))
+
+        header = BlockHeader.from_dict(entry["header"])
+
+        # Genesis has no proof of work.
+        check_header(header,
+                     entry["hash"],
+                     self.hashes[-1] if self.hashes else GENESIS_PREVIOUS_HASH,
+                     Blockchain.difficulty if self.hashes else 0)
+
+        self.hashes.append(entry["hash"])
+        self._headers[entry["hash"]] = header
+
+    def verify_inclusion(self, transaction, merkle_proof):
+        """
+        Checks a proof from /merkle_proof against our own copy of the block header.
+        The leaf is the hash of the whole transaction, so its inputs and outputs are proven too.
+        @param transaction: Transaction instance.
+        @param merkle_proof: Block hash, height, index and proof.
+        @return: True if the transaction is in a block of this header chain.
+        """
+        height = merkle_proof["height"]
+
+        if height >= len(self.hashes) or self.hashes[height] != merkle_proof["block_hash"]:
+            return False
+
+        return MerkleTree.verify_proof(tx_hash(transaction),
+                                       merkle_proof["index"],
+                                       merkle_proof["proof"],
+                                       self._headers[merkle_proof["block_hash"]].merkle_root)
+
+    @property
+    def height(self):
+        return len(self.hashes)